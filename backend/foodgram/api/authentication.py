@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from users.models import auth_token_cache_key
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''
+    Проверка токена с кешированием пользователя: повторные запросы
+    с тем же токеном не обращаются к базе. Запись в кеше удаляется
+    при удалении токена и при сохранении пользователя.
+    '''
+
+    def authenticate_credentials(self, key):
+        cache_key = auth_token_cache_key(key)
+        user = cache.get(cache_key)
+
+        if user is None:
+            user, token = super().authenticate_credentials(key)
+            cache.set(cache_key, user, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+            return user, token
+
+        return user, Token(key=key, user=user)
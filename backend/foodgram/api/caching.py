@@ -0,0 +1,309 @@
+import gzip
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+from django.http import HttpResponse
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date, quote_etag
+from rest_framework.renderers import JSONRenderer
+
+from foodgram.db_routing import primary_reads
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import Follow
+
+
+class PublicCacheMixin:
+    '''
+    Заголовки для кеширующего прокси: успешные GET-ответы анонимам
+    публичны на короткое время, остальные только для клиента.
+    Surrogate-Key позволяет CDN сбрасывать ответы по ключам.
+    '''
+    public_cache_max_age = settings.PUBLIC_CACHE_MAX_AGE
+
+    def surrogate_keys(self):
+        keys = [self.basename]
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        if lookup_url_kwarg in self.kwargs:
+            keys.append(f'{self.basename}-{self.kwargs[lookup_url_kwarg]}')
+
+        return keys
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+
+        if request.method not in ('GET', 'HEAD'):
+            return response
+
+        patch_vary_headers(response, ('Authorization',))
+
+        if (
+            request.user.is_anonymous
+            and response.status_code in (200, 304)
+        ):
+            patch_cache_control(
+                response,
+                public=True,
+                max_age=self.public_cache_max_age,
+                stale_while_revalidate=(
+                    settings.PUBLIC_CACHE_STALE_WHILE_REVALIDATE
+                ),
+            )
+            response['Surrogate-Key'] = ' '.join(self.surrogate_keys())
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+
+        return response
+
+
+class CatalogCacheMixin:
+    '''
+    Отдает полный список справочника из кеша, привязанного к версии
+    каталога: готовый JSON и его gzip-вариант, сильный ETag и 304.
+    '''
+
+    def catalog_model(self):
+        return self.get_queryset().model
+
+    def is_catalog_request(self, request):
+        return (
+            not request.query_params
+            and request.accepted_renderer.format == 'json'
+        )
+
+    def get_catalog_payload(self, version):
+        model = self.catalog_model()
+        key = f'catalog:{model._meta.label_lower}:{version}'
+
+        payload = cache.get(key)
+        if payload is None:
+            with primary_reads():
+                serializer = self.get_serializer(
+                    self.get_queryset(), many=True
+                )
+                body = JSONRenderer().render(serializer.data)
+            payload = {
+                'identity': body,
+                'gzip': gzip.compress(body),
+            }
+            cache.set(key, payload, settings.CATALOG_CACHE_TIMEOUT)
+
+        return payload
+
+    def catalog_response(self, request):
+        version = self.catalog_model().catalog_version()
+        etags = {
+            'identity': f'"{version}"',
+            'gzip': f'"{version}-gzip"',
+        }
+
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        encoding = 'gzip' if 'gzip' in accept_encoding else 'identity'
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+        if any(etag in if_none_match for etag in etags.values()):
+            response = HttpResponse(status=304)
+        else:
+            payload = self.get_catalog_payload(version)
+            response = HttpResponse(
+                payload[encoding], content_type='application/json'
+            )
+            if encoding == 'gzip':
+                response['Content-Encoding'] = 'gzip'
+
+        response['ETag'] = etags[encoding]
+        response['Vary'] = 'Accept-Encoding'
+
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if self.is_catalog_request(request):
+            return self.catalog_response(request)
+
+        return super().list(request, *args, **kwargs)
+
+
+def query_digest(request):
+    # В ответе есть абсолютные ссылки, поэтому учитывается и хост
+    params = sorted(
+        (name, sorted(values))
+        for name, values in request.query_params.lists()
+    )
+    return hashlib.md5(
+        f'{request.get_host()}:{params}'.encode()
+    ).hexdigest()
+
+
+class RecipeConditionalMixin:
+    '''
+    Условные GET-запросы для рецептов: ETag (и Last-Modified для анонимов)
+    считаются по времени изменения рецептов без сериализации.
+    ETag списка строится по поколению рецептов и параметрам запроса
+    только для анонимных пользователей, так как для остальных в ответе
+    есть флаги избранного, корзины и подписок.
+    '''
+
+    def catalogs_version(self):
+        return f'{Tag.catalog_version()}:{Ingredient.catalog_version()}'
+
+    def make_etag(self, *parts):
+        return hashlib.md5(
+            ':'.join(str(part) for part in parts).encode()
+        ).hexdigest()
+
+    def retrieve_validators(self):
+        user = self.request.user
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = Recipe.objects.with_user_flags(user).filter(
+            pk=self.kwargs[lookup_url_kwarg]
+        )
+        fields = ['updated']
+
+        if not user.is_anonymous:
+            queryset = queryset.annotate(
+                author_subscribed=Exists(Follow.objects.filter(
+                    user=user, author=OuterRef('author')
+                ))
+            )
+            fields += ['favorited', 'in_cart', 'author_subscribed']
+
+        values = queryset.values_list(*fields).first()
+        if values is None:
+            return None, None
+
+        etag = self.make_etag(user.pk, *values, self.catalogs_version())
+        last_modified = None
+        if user.is_anonymous:
+            last_modified = int(values[0].timestamp())
+
+        return etag, last_modified
+
+    def list_validators(self):
+        # Без запросов к базе: поколение рецептов меняется при любом
+        # изменении рецептов, их связей и данных авторов
+        if not self.request.user.is_anonymous:
+            return None, None
+
+        etag = self.make_etag(
+            Recipe.catalog_version(), self.catalogs_version(),
+            query_digest(self.request)
+        )
+
+        return etag, None
+
+    def conditional(self, validators, handler, request, *args, **kwargs):
+        etag, last_modified = validators
+
+        if etag is not None:
+            response = get_conditional_response(
+                request, etag=quote_etag(etag), last_modified=last_modified
+            )
+            if response is not None:
+                return response
+
+        response = handler(request, *args, **kwargs)
+
+        if etag is not None and response.status_code == 200:
+            response['ETag'] = quote_etag(etag)
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(
+            self.retrieve_validators(), super().retrieve,
+            request, *args, **kwargs
+        )
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(
+            self.list_validators(), super().list,
+            request, *args, **kwargs
+        )
+
+
+RESPONSE_CACHE_STATS_KEY = 'recipe-list-cache:{}'
+
+
+def count_response_cache(outcome):
+    key = RESPONSE_CACHE_STATS_KEY.format(outcome)
+    cache.add(key, 0, None)
+    cache.incr(key)
+
+
+def response_cache_stats():
+    return {
+        outcome: cache.get(RESPONSE_CACHE_STATS_KEY.format(outcome), 0)
+        for outcome in ('hits', 'misses')
+    }
+
+
+class RecipeListCacheMixin:
+    '''
+    Готовые ответы списка рецептов для анонимов в кеше. Ключ состоит
+    из поколения рецептов, версий справочников и нормализованных
+    параметров запроса, поэтому любое изменение делает старые ключи
+    недоступными.
+    '''
+
+    def is_list_cacheable(self, request):
+        return (
+            request.user.is_anonymous
+            and request.accepted_renderer.format == 'json'
+        )
+
+    def list_cache_key(self, request):
+        return (
+            f'recipe-list:{Recipe.catalog_version()}:'
+            f'{Tag.catalog_version()}:{Ingredient.catalog_version()}:'
+            f'{query_digest(request)}'
+        )
+
+    def list(self, request, *args, **kwargs):
+        if not self.is_list_cacheable(request):
+            return super().list(request, *args, **kwargs)
+
+        key = self.list_cache_key(request)
+        payload = cache.get(key)
+
+        if payload is None:
+            count_response_cache('misses')
+            # Страница попадает в кеш до следующего изменения,
+            # поэтому читается из основной базы, а не из реплики
+            with primary_reads():
+                response = super().list(request, *args, **kwargs)
+
+            if response.status_code != 200:
+                return response
+
+            payload = {
+                'body': JSONRenderer().render(response.data),
+                'etag': response.get('ETag'),
+            }
+            cache.set(key, payload, settings.RECIPE_LIST_CACHE_TIMEOUT)
+            outcome = 'MISS'
+        else:
+            count_response_cache('hits')
+            outcome = 'HIT'
+
+        etag = payload['etag']
+        if etag and etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+            response = HttpResponse(status=304)
+        else:
+            response = HttpResponse(
+                payload['body'], content_type='application/json'
+            )
+
+        if etag:
+            response['ETag'] = etag
+        response['X-Cache'] = outcome
+
+        return response
@@ -1,7 +1,9 @@
 from django_filters import rest_framework
 from django.contrib.auth import get_user_model
+from django.db.models import Exists, OuterRef
 
-from recipes.models import Recipe, Ingredient
+from recipes.models import Recipe, Ingredient, Tag
+from recipes.search import get_recipe_search
 
 User = get_user_model()
 
@@ -15,12 +17,17 @@ def queryset_cutter(queryset, value):
     return queryset[:value] if value > 0 else queryset
 
 
+def tag_choices():
+    return [(slug, slug) for slug in Tag.cached_slugs()]
+
+
 class RecipeFilter(rest_framework.FilterSet):
     author = rest_framework.ModelChoiceFilter(
         queryset=User.objects.all()
     )
-    tags = rest_framework.AllValuesMultipleFilter(
-        field_name='tags__slug'
+    tags = rest_framework.MultipleChoiceFilter(
+        choices=tag_choices,
+        method='tags_filter'
     )
     is_favorited = rest_framework.BooleanFilter(
         method='is_favorited_filter'
@@ -28,6 +35,27 @@ class RecipeFilter(rest_framework.FilterSet):
     is_in_shopping_cart = rest_framework.BooleanFilter(
         method='is_in_shopping_cart_filter',
     )
+    search = rest_framework.CharFilter(
+        method='search_filter'
+    )
+
+    def search_filter(self, queryset, name, value):
+        return get_recipe_search().search(queryset, value)
+
+    def tags_filter(self, queryset, name, value):
+        '''
+        EXISTS по связям рецепт-тег: рецепт не дублируется,
+        даже если совпало несколько тегов.
+        '''
+        slugs = Tag.cached_slugs()
+        tagged = Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'),
+            tag_id__in=[slugs[slug] for slug in value]
+        )
+
+        return queryset.annotate(
+            has_tags=Exists(tagged)
+        ).filter(has_tags=True)
 
     def is_favorited_filter(self, queryset, name, value):
         user = self.request.user
@@ -0,0 +1,100 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.serializers import FastRecipeSerializer, RecipeSerializer
+from recipes.models import Recipe
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает вывод FastRecipeSerializer и RecipeSerializer '
+        'и измеряет время обоих'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int,
+            help='id пользователя, от имени которого строится ответ'
+        )
+        parser.add_argument(
+            '--limit', type=int, default=100,
+            help='Количество рецептов'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Количество повторов при замере'
+        )
+
+    def make_request(self, user_id):
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        request.user = (
+            User.objects.get(pk=user_id) if user_id else AnonymousUser()
+        )
+
+        return request
+
+    def serialize_models(self, request, limit):
+        recipes = Recipe.objects.for_read().with_user_flags(
+            request.user
+        ).order_by('-id')[:limit]
+        serializer = RecipeSerializer(
+            recipes, many=True, context={'request': request}
+        )
+
+        return JSONRenderer().render(serializer.data)
+
+    def serialize_rows(self, request, limit):
+        serializer = FastRecipeSerializer({'request': request})
+        rows = serializer.rows(
+            Recipe.objects.with_user_flags(request.user).order_by('-id')
+        )[:limit]
+
+        return JSONRenderer().render(serializer.serialize(rows))
+
+    def measure(self, serialize, request, limit, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            serialize(request, limit)
+
+        return (time.perf_counter() - started) / repeat * 1000
+
+    def handle(self, *args, **options):
+        request = self.make_request(options['user'])
+        limit = options['limit']
+
+        expected = self.serialize_models(request, limit)
+        actual = self.serialize_rows(request, limit)
+        if expected != actual:
+            position = next(
+                index for index, (left, right)
+                in enumerate(zip(expected, actual)) if left != right
+            ) if len(expected) == len(actual) else min(
+                len(expected), len(actual)
+            )
+            raise CommandError(
+                'Ответы различаются начиная с байта '
+                f'{position}: {expected[position:position + 80]!r} '
+                f'!= {actual[position:position + 80]!r}'
+            )
+
+        self.stdout.write(f'Ответы совпадают: {len(expected)} байт')
+
+        model_time = self.measure(
+            self.serialize_models, request, limit, options['repeat']
+        )
+        rows_time = self.measure(
+            self.serialize_rows, request, limit, options['repeat']
+        )
+        self.stdout.write(
+            f'RecipeSerializer: {model_time:.1f} мс, '
+            f'FastRecipeSerializer: {rows_time:.1f} мс, '
+            f'ускорение: {model_time / rows_time:.1f}x'
+        )
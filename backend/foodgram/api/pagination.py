@@ -1,8 +1,91 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+from collections import OrderedDict
 
-from foodgram.settings import PAGINATION_PAGE_SIZE
+from django.core.cache import cache
+from django.db.models import QuerySet
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+
+from foodgram.settings import (
+    PAGINATION_PAGE_SIZE,
+    PAGINATION_COUNT_CACHE_TIMEOUT,
+)
+
+
+class FoodgramCursorPagination(CursorPagination):
+    '''
+    Keyset-пагинация по -id без OFFSET и без COUNT(*) на каждой странице.
+    Общее количество отдается только по запросу ?count=1 и кешируется.
+    '''
+    page_size = PAGINATION_PAGE_SIZE
+    page_size_query_param = 'limit'
+    ordering = '-id'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            self.count = self.get_cached_count(queryset)
+
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_cached_count(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        key = 'pagination-count:' + hashlib.md5(
+            f'{sql}{params}'.encode()
+        ).hexdigest()
+
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, PAGINATION_COUNT_CACHE_TIMEOUT)
+
+        return count
+
+    def get_paginated_response(self, data):
+        response = OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ])
+        if self.count is not None:
+            response['count'] = self.count
+            response.move_to_end('count', last=False)
+
+        return Response(response)
 
 
 class FoodgramPagination(PageNumberPagination):
+    '''
+    Постраничная пагинация page/limit. При ?pagination=cursor
+    (или при наличии cursor) переключается на keyset-пагинацию;
+    готовые списки всегда разбиваются по страницам.
+    '''
     page_size = PAGINATION_PAGE_SIZE
     page_size_query_param = 'limit'
+    mode_query_param = 'pagination'
+    cursor_pagination_class = FoodgramCursorPagination
+
+    def is_cursor_mode(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or self.cursor_pagination_class.cursor_query_param
+            in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+
+        if isinstance(queryset, QuerySet) and self.is_cursor_mode(request):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+
+        return super().get_paginated_response(data)
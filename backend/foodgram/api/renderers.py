@@ -0,0 +1,19 @@
+from rest_framework.renderers import JSONRenderer
+
+
+class PlainTextRenderer(JSONRenderer):
+    """
+    Позволяет запрашивать выгрузку в виде ?file_format=txt
+    (и ?format=txt через согласование формата DRF).
+    """
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CSVRenderer(JSONRenderer):
+    """
+    Позволяет запрашивать выгрузку в виде ?file_format=csv
+    (и ?format=csv через согласование формата DRF).
+    """
+    media_type = 'text/csv'
+    format = 'csv'
@@ -1,4 +1,6 @@
-import base64, uuid
+import base64, json, uuid
+from types import SimpleNamespace
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from django.core import exceptions as django_exceptions
@@ -6,7 +8,10 @@ from rest_framework import serializers, status
 from rest_framework.validators import UniqueValidator
 from rest_framework.exceptions import APIException
 from django.core.files.base import ContentFile
+from django.db import transaction
 
+from recipes.images import derivative_urls
+from recipes.search import get_recipe_search
 from recipes.models import Tag, Ingredient, Recipe, IngredientRecipeRelation
 from .filters import queryset_cutter
 
@@ -14,6 +19,16 @@ User = get_user_model()
 
 
 class Base64ImageField(serializers.ImageField):
+    '''
+    Изображение в виде base64 data URI или обычного файла multipart-формы.
+    '''
+    default_error_messages = {
+        'too_large': 'Размер изображения не может превышать {max_size} байт',
+        'too_big': (
+            'Размеры изображения не могут превышать {max_dimension} px'
+        ),
+    }
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
@@ -23,7 +38,17 @@ class Base64ImageField(serializers.ImageField):
                 base64.b64decode(imgstr), name = id.urn[9:] + '.' + ext
             )
 
-        return super(Base64ImageField, self).to_internal_value(data)
+        max_size = settings.RECIPE_IMAGE_MAX_SIZE
+        if getattr(data, 'size', 0) > max_size:
+            self.fail('too_large', max_size=max_size)
+
+        image_file = super(Base64ImageField, self).to_internal_value(data)
+
+        max_dimension = settings.RECIPE_IMAGE_MAX_DIMENSION
+        if max(image_file.image.size) > max_dimension:
+            self.fail('too_big', max_dimension=max_dimension)
+
+        return image_file
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -51,10 +76,17 @@ class UserSerializer(serializers.ModelSerializer):
     def get_is_subscribed(self, author):
         user = self.context.get('request').user
         
-        try:
-            return user.is_subscribed(author)
-        except AttributeError:
-            return 0
+        # Подписки пользователя загружаются один раз на весь ответ
+        followed_ids = self.context.get('followed_authors_ids')
+        if followed_ids is None:
+            try:
+                followed_ids = user.followed_authors_ids()
+            except AttributeError:
+                return 0
+
+            self.context['followed_authors_ids'] = followed_ids
+
+        return author.id in followed_ids
 
     def validate_username(self, username):
         if username == 'me':
@@ -112,6 +144,14 @@ class UserSetPasswordSerializer(serializers.Serializer):
         return super().validate(attrs)
 
 
+class RecipeIdsSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100
+    )
+
+
 class IngredientSerializer(serializers.ModelSerializer):
     class Meta:
         fields = ('id', 'name', 'measurement_unit')
@@ -140,38 +180,229 @@ class IngredientRecipeRelationSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount', 'name', 'measurement_unit')
 
 
+def image_variants(image_name, request=None):
+    urls = derivative_urls(image_name)
+    if request is None:
+        return urls
+
+    return {
+        size: {
+            extension: request.build_absolute_uri(url)
+            for extension, url in formats.items()
+        }
+        for size, formats in urls.items()
+    }
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     image = Base64ImageField()
+    image_variants = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     tags = TagSerializer(many=True)
     ingredients = serializers.SerializerMethodField()
 
     def get_ingredients(self, recipe):
-        relation = IngredientRecipeRelation.objects.filter(recipe=recipe)
+        relation = recipe.ingredientreciperelation_set.all()
         serializer = IngredientRecipeRelationSerializer(relation, many=True)
         return serializer.data
 
+    def get_image_variants(self, recipe):
+        if not recipe.image_processed:
+            return None
+
+        return image_variants(recipe.image.name, self.context.get('request'))
+
     def get_is_favorited(self, recipe):
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
 
-        return recipe.is_favorited(request.user)
+        favorited = getattr(recipe, 'favorited', None)
+        if favorited is None:
+            return recipe.is_favorited(request.user)
+
+        return favorited
     
     def get_is_in_shopping_cart(self, recipe):
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
 
-        return recipe.is_in_shopping_cart(request.user)
+        in_cart = getattr(recipe, 'in_cart', None)
+        if in_cart is None:
+            return recipe.is_in_shopping_cart(request.user)
+
+        return in_cart
+
+    def to_representation(self, recipe):
+        data = super().to_representation(recipe)
+
+        # При поиске добавляется фрагмент текста с подсветкой совпадений
+        request = self.context.get('request')
+        query = request.query_params.get('search') if request else None
+        if query and hasattr(recipe, 'search_rank'):
+            data['search_snippet'] = self.search_snippets(query, recipe)[
+                recipe.id
+            ]
+
+        return data
+
+    def search_snippets(self, query, recipe):
+        # Фрагменты считаются сразу для всей страницы одним запросом
+        snippets = self.context.get('search_snippets')
+        if snippets is None or recipe.id not in snippets:
+            recipes = [recipe]
+            if isinstance(self.parent, serializers.ListSerializer):
+                recipes = self.parent.instance
+
+            snippets = get_recipe_search().snippets(recipes, query)
+            self.context['search_snippets'] = snippets
+
+        return snippets
 
     class Meta:
-        fields = '__all__'
+        exclude = (
+            'created', 'updated', 'image_processed', 'image_failed',
+            'search_vector', 'favorites_count', 'in_carts_count',
+            'neighbors_updated'
+        )
         model = Recipe
 
 
+class FastRecipeSerializer:
+    '''
+    Сериализация рецептов для чтения без DRF-полей: ответ собирается
+    из строк values() и двух запросов за тегами и ингредиентами.
+    Результат совпадает с RecipeSerializer байт в байт, проверка:
+    manage.py recipe_serializer_benchmark.
+    '''
+    fields = (
+        'id', 'name', 'text', 'cooking_time', 'image', 'image_processed',
+        'author_id', 'author__username', 'author__email',
+        'author__first_name', 'author__last_name',
+    )
+    optional_fields = ('favorited', 'in_cart', 'search_rank')
+
+    def __init__(self, context):
+        self.context = context
+        self.request = context.get('request')
+
+    def rows(self, queryset):
+        annotations = queryset.query.annotations
+        return queryset.values(
+            *self.fields,
+            *(field for field in self.optional_fields if field in annotations)
+        )
+
+    def followed_authors_ids(self):
+        user = self.request.user
+        if user.is_anonymous:
+            return None
+
+        # Тот же кеш в контексте, что и у UserSerializer.get_is_subscribed
+        followed_ids = self.context.get('followed_authors_ids')
+        if followed_ids is None:
+            followed_ids = user.followed_authors_ids()
+            self.context['followed_authors_ids'] = followed_ids
+
+        return followed_ids
+
+    def related_data(self, recipe_ids):
+        tags = {recipe_id: [] for recipe_id in recipe_ids}
+        recipe_tags = Recipe.tags.through.objects.filter(
+            recipe_id__in=recipe_ids
+        ).order_by('tag_id').values_list(
+            'recipe_id', 'tag_id', 'tag__name', 'tag__slug', 'tag__color'
+        )
+        for recipe_id, tag_id, name, slug, color in recipe_tags:
+            tags[recipe_id].append(
+                {'id': tag_id, 'name': name, 'slug': slug, 'color': color}
+            )
+
+        ingredients = {recipe_id: [] for recipe_id in recipe_ids}
+        relations = IngredientRecipeRelation.objects.filter(
+            recipe_id__in=recipe_ids
+        ).order_by('id').values_list(
+            'recipe_id', 'ingredient_id', 'amount',
+            'ingredient__name', 'ingredient__measurement_unit'
+        )
+        for recipe_id, ingredient_id, amount, name, unit in relations:
+            ingredients[recipe_id].append({
+                'id': ingredient_id,
+                'amount': amount,
+                'name': name,
+                'measurement_unit': unit,
+            })
+
+        return tags, ingredients
+
+    def serialize(self, rows):
+        rows = list(rows)
+        if not rows:
+            return []
+
+        tags, ingredients = self.related_data([row['id'] for row in rows])
+
+        request = self.request
+        followed_ids = self.followed_authors_ids()
+        is_anonymous = request.user.is_anonymous
+        query = request.query_params.get('search')
+        storage = Recipe._meta.get_field('image').storage
+        data = []
+
+        if query and 'search_rank' in rows[0]:
+            snippets = get_recipe_search().snippets(
+                [SimpleNamespace(**row) for row in rows], query
+            )
+
+        for row in rows:
+            image_url = None
+            if row['image']:
+                image_url = request.build_absolute_uri(
+                    storage.url(row['image'])
+                )
+
+            item = {
+                'id': row['id'],
+                'author': {
+                    'id': row['author_id'],
+                    'username': row['author__username'],
+                    'email': row['author__email'],
+                    'first_name': row['author__first_name'],
+                    'last_name': row['author__last_name'],
+                    'is_subscribed': (
+                        0 if followed_ids is None
+                        else row['author_id'] in followed_ids
+                    ),
+                },
+                'image': image_url,
+                'image_variants': (
+                    image_variants(row['image'], request)
+                    if row['image_processed'] else None
+                ),
+                'is_favorited': (
+                    False if is_anonymous else row['favorited']
+                ),
+                'is_in_shopping_cart': (
+                    False if is_anonymous else row['in_cart']
+                ),
+                'tags': tags[row['id']],
+                'ingredients': ingredients[row['id']],
+                'name': row['name'],
+                'text': row['text'],
+                'cooking_time': row['cooking_time'],
+            }
+
+            if query and 'search_rank' in row:
+                item['search_snippet'] = snippets[row['id']]
+
+            data.append(item)
+
+        return data
+
+
 class PostRecipeSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     image = Base64ImageField()
@@ -182,7 +413,9 @@ class PostRecipeSerializer(serializers.ModelSerializer):
     )
 
     def get_ingredients(self, recipe):
-        relation = IngredientRecipeRelation.objects.filter(recipe=recipe)
+        relation = recipe.ingredientreciperelation_set.select_related(
+            'ingredient'
+        )
         serializer = IngredientRecipeRelationSerializer(relation, many=True)
         return serializer.data
     
@@ -190,7 +423,7 @@ class PostRecipeSerializer(serializers.ModelSerializer):
         relations = (
             IngredientRecipeRelation(
                 recipe=instance,
-                ingredient=Ingredient.objects.get(id=ingredient['id']),
+                ingredient=ingredient['ingredient'],
                 amount=ingredient['amount']
             ) for ingredient in ingredients
         )
@@ -198,22 +431,59 @@ class PostRecipeSerializer(serializers.ModelSerializer):
         IngredientRecipeRelation.objects.bulk_create(
             relations
         )
+
+    def relation_updater(self, instance, ingredients):
+        '''
+        Применяет к связям рецепта только разницу с новым списком:
+        одно удаление, одна вставка и одно обновление количества.
+        '''
+        old_relations = {
+            relation.ingredient_id: relation
+            for relation in IngredientRecipeRelation.objects.filter(
+                recipe=instance
+            )
+        }
+        new_ingredients = {
+            ingredient['ingredient'].id: ingredient
+            for ingredient in ingredients
+        }
+
+        removed = old_relations.keys() - new_ingredients.keys()
+        if removed:
+            IngredientRecipeRelation.objects.filter(
+                recipe=instance, ingredient_id__in=removed
+            ).delete()
+
+        added = [
+            ingredient for id, ingredient in new_ingredients.items()
+            if id not in old_relations
+        ]
+        if added:
+            self.relation_creator(instance, added)
+
+        changed = []
+        for id, relation in old_relations.items():
+            ingredient = new_ingredients.get(id)
+            if ingredient and relation.amount != ingredient['amount']:
+                relation.amount = ingredient['amount']
+                changed.append(relation)
+
+        if changed:
+            IngredientRecipeRelation.objects.bulk_update(changed, ['amount'])
     
+    @transaction.atomic
     def create(self, validated_data):
-        request = self.context.get('request')
         tags = validated_data.pop('tags')
-        ingredients = request.data['ingredients']
+        ingredients = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
         
         self.relation_creator(recipe, ingredients)
 
-        recipe.save()
-
         return recipe
     
+    @transaction.atomic
     def update(self, instance, validated_data):
-        request = self.context.get('request')
         instance.name = validated_data.get('name', instance.name)
         instance.text = validated_data.get('text', instance.text)
         instance.image = validated_data.get('image', instance.image)
@@ -226,15 +496,9 @@ class PostRecipeSerializer(serializers.ModelSerializer):
         if tags:
             instance.tags.set(tags)
         
-        ingredients = request.data.get('ingredients')
+        ingredients = validated_data.get('ingredients')
         if ingredients:
-            # Удаление старых связей
-            old_ingredients_relations = instance.ingredients.all()
-            for ingredient in old_ingredients_relations:
-                instance.ingredients.remove(ingredient)
-
-            # Создание новых
-            self.relation_creator(instance, ingredients)
+            self.relation_updater(instance, ingredients)
 
         instance.save()
 
@@ -260,12 +524,19 @@ class PostRecipeSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         ingredients = request.data.get('ingredients')
 
+        # В multipart-форме ингредиенты передаются JSON-строкой
+        if isinstance(ingredients, str):
+            try:
+                ingredients = json.loads(ingredients)
+            except ValueError:
+                ingredients = None
+
         if not isinstance(ingredients, list) or len(ingredients) == 0:
             raise serializers.ValidationError(
                 {'ingredients': 'Список ингредиентов пуст или некорректен'}
             )
         
-        ingredients_ids = []
+        amounts = {}
 
         for ingredient in ingredients:
             if not isinstance(ingredient, dict):
@@ -274,12 +545,7 @@ class PostRecipeSerializer(serializers.ModelSerializer):
                 )
 
             try:
-                id = ingredient['id']
-                if Ingredient.objects.filter(id=id).first() is None:
-                    raise serializers.ValidationError(
-                        'Несуществующий ингредиент(ы)'
-                    )
-
+                id = int(ingredient['id'])
                 amount = ingredient['amount']
                 try:
                     amount = int(amount)
@@ -293,26 +559,42 @@ class PostRecipeSerializer(serializers.ModelSerializer):
                         'Количество ингредиента не может быть меньше 1'
                     )
             
-                ingredients_ids.append(id)
+                if id in amounts:
+                    raise serializers.ValidationError(
+                        'Ингредиенты повторяются'
+                    )
+
+                amounts[id] = amount
             except KeyError:
                 raise serializers.ValidationError(
                         'Отсутствуют необходимые поля'
                     )
-            except ValueError:
+            except (TypeError, ValueError):
                 raise serializers.ValidationError(
                         'Неккоректные значения полей'
                     )
-        
-        if len(ingredients_ids) != len(set(ingredients_ids)):
+
+        # Все ингредиенты запрашиваются одним запросом
+        existing = Ingredient.objects.in_bulk(list(amounts))
+        if len(existing) != len(amounts):
             raise serializers.ValidationError(
-                'Ингредиенты повторяются'
+                'Несуществующий ингредиент(ы)'
             )
 
+        attrs['ingredients'] = [
+            {'ingredient': existing[id], 'amount': amount}
+            for id, amount in amounts.items()
+        ]
+
         return attrs
     
     class Meta:
         model = Recipe
-        fields = '__all__'
+        exclude = (
+            'created', 'updated', 'image_processed', 'image_failed',
+            'search_vector', 'favorites_count', 'in_carts_count',
+            'neighbors_updated'
+        )
 
 
 class RecipeSubscribeSerializer(serializers.ModelSerializer):
@@ -324,18 +606,19 @@ class RecipeSubscribeSerializer(serializers.ModelSerializer):
 
 
 class SubscriptionSerializer(UserSerializer):
-    recipes_count = serializers.IntegerField(
-        source='recipes.count',
-        read_only=True
-    )
+    recipes_count = serializers.IntegerField(read_only=True)
     recipes = serializers.SerializerMethodField()
     
     def get_recipes(self, author):
-        limit_value = self.context.get('request').GET.get('recipes_limit')
-        queryset = Recipe.objects.filter(author=author)
-        
-        if limit_value:
-            queryset = queryset_cutter(queryset, limit_value)
+        author_recipes = self.context.get('author_recipes')
+        if author_recipes is not None:
+            queryset = author_recipes.get(author.id, [])
+        else:
+            limit_value = self.context.get('request').GET.get('recipes_limit')
+            queryset = Recipe.objects.filter(author=author)
+
+            if limit_value:
+                queryset = queryset_cutter(queryset, limit_value)
         
         serializer = RecipeSubscribeSerializer(
             queryset, many=True
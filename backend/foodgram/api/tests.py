@@ -0,0 +1,144 @@
+import base64
+import io
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.test import override_settings
+from PIL import Image
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from recipes.models import Ingredient, Tag
+from users.models import Follow, User
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def image_data_uri():
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 30), 'red').save(buffer, 'PNG')
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+
+    return f'data:image/png;base64,{encoded}'
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    },
+)
+class FastRecipeSerializerTest(APITestCase):
+    '''
+    FastRecipeSerializer должен отдавать то же, что и RecipeSerializer.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.reader = (
+            User.objects.create_user(
+                username=username, email=f'{username}@foodgram.ru',
+                password='Pass12345!', first_name='Имя', last_name='Фамилия'
+            )
+            for username in ('author', 'reader')
+        )
+        tags = [
+            Tag.objects.create(
+                name=f'Тег {index}', slug=f'tag{index}', color='#00ff00'
+            )
+            for index in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {index}', measurement_unit='г'
+            )
+            for index in range(5)
+        ]
+
+        client = APIClient()
+        client.force_authenticate(cls.author)
+        cls.recipe_ids = []
+        for index in range(6):
+            response = client.post('/api/recipes/', {
+                'name': f'Суп <{index}>',
+                'text': f'Варить суп & остужать {index}',
+                'cooking_time': index + 1,
+                'image': image_data_uri(),
+                'tags': [tags[index % 3].id, tags[(index + 1) % 3].id],
+                'ingredients': [
+                    {'id': ingredient.id, 'amount': amount + 1}
+                    for amount, ingredient
+                    in enumerate(ingredients[:index % 5 + 1])
+                ],
+            }, format='json')
+            cls.recipe_ids.append(response.json()['id'])
+
+        client.force_authenticate(cls.reader)
+        client.post(f'/api/recipes/{cls.recipe_ids[0]}/favorite/')
+        client.post(f'/api/recipes/{cls.recipe_ids[1]}/shopping_cart/')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def get(self, url, user, fast):
+        cache.clear()
+        if user is None:
+            self.client.force_authenticate(None)
+        else:
+            self.client.force_authenticate(user)
+
+        with self.settings(RECIPE_FAST_SERIALIZER=fast):
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.content
+
+    def assertSameResponses(self, url):
+        for user in (None, self.reader, self.author):
+            with self.subTest(url=url, user=user):
+                self.assertEqual(
+                    self.get(url, user, fast=False),
+                    self.get(url, user, fast=True)
+                )
+
+    def test_list(self):
+        self.assertSameResponses('/api/recipes/')
+        self.assertSameResponses('/api/recipes/?limit=2&page=2')
+
+    def test_detail(self):
+        for recipe_id in self.recipe_ids[:2]:
+            self.assertSameResponses(f'/api/recipes/{recipe_id}/')
+
+    def test_filters(self):
+        self.assertSameResponses('/api/recipes/?tags=tag1')
+        self.assertSameResponses(f'/api/recipes/?author={self.author.id}')
+
+    def test_user_filters(self):
+        for url in (
+            '/api/recipes/?is_favorited=1',
+            '/api/recipes/?is_in_shopping_cart=1',
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(
+                    self.get(url, self.reader, fast=False),
+                    self.get(url, self.reader, fast=True)
+                )
+
+    def test_search(self):
+        self.assertSameResponses('/api/recipes/?search=суп')
+        self.assertSameResponses('/api/recipes/?search=остужать 3')
+
+    def test_cursor_pagination(self):
+        self.assertSameResponses('/api/recipes/?pagination=cursor&limit=2')
+
+    def test_missing_recipe(self):
+        with self.settings(RECIPE_FAST_SERIALIZER=True):
+            response = self.client.get('/api/recipes/0/')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
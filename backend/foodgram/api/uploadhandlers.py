@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class ImageTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_code = 'too_large'
+
+    def __init__(self):
+        super().__init__(
+            'Размер изображения не может превышать '
+            f'{settings.RECIPE_IMAGE_MAX_SIZE} байт'
+        )
+
+
+def check_request_size(request):
+    '''
+    Отклоняет тело больше RECIPE_REQUEST_MAX_SIZE до его чтения:
+    изображение в base64 читается парсером JSON целиком.
+    '''
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        content_length = 0
+
+    if content_length > settings.RECIPE_REQUEST_MAX_SIZE:
+        raise ImageTooLarge()
+
+
+class LimitedTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    '''
+    Пишет файл multipart-формы во временный файл частями и прерывает
+    загрузку, как только файл превысит RECIPE_IMAGE_MAX_SIZE.
+    '''
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.RECIPE_IMAGE_MAX_SIZE:
+            self.file.close()
+            raise ImageTooLarge()
+
+        return super().receive_data_chunk(raw_data, start)
@@ -1,45 +1,91 @@
-from django.http.response import HttpResponse
+import csv
+import json
+
+from django.db.models import Sum
+from django.http.response import StreamingHttpResponse
 
 from recipes.models import IngredientRecipeRelation
 
-def shopping_cart_downloader(shopping_cart_objects):
-        shopping_cart = {}
-        response_list = []
-
-        # Сборка ингредиентов в словарь
-        for obj in shopping_cart_objects:
-            recipe = obj.recipe
-            ingredients = IngredientRecipeRelation.objects.filter(
-                recipe=recipe
-            )
-
-            for ingredient in ingredients:
-                name = ingredient.ingredient.name
-                amount = ingredient.amount
-                measurement_unit = ingredient.ingredient.measurement_unit
-
-                if name in shopping_cart.keys():
-                    shopping_cart[name]['amount'] += amount
-
-                else:
-                    shopping_cart[name] = {
-                        'amount': amount,
-                        'measurement_unit': measurement_unit
-                    }
-        
-        # Формирование списка
-        for name in shopping_cart.keys():
-            subject = shopping_cart[name]
-            response_list.append(
-                f'{name}: {subject["amount"]} {subject["measurement_unit"]}\n'
-        )
-            
-        response_obj = HttpResponse(
-            response_list,
-            'Content-Type: text/plain'
-        )
-        response_obj['Content-Disposition'] = (
-            'attachment;' 'filename="shopping_cart.txt"'
+SHOPPING_CART_FORMATS = {
+    'txt': 'text/plain; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+    'json': 'application/json',
+}
+
+
+class Echo:
+    '''
+    Псевдо-буфер для csv.writer: возвращает строку вместо записи.
+    '''
+
+    def write(self, value):
+        return value
+
+
+def shopping_cart_ingredients(user):
+    '''
+    Суммирует ингредиенты всех рецептов из корзины одним запросом.
+    '''
+    return IngredientRecipeRelation.objects.filter(
+        recipe__in_shopping_cart__user=user
+    ).values(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).annotate(
+        total_amount=Sum('amount')
+    ).order_by('ingredient__name', 'ingredient__measurement_unit')
+
+
+def txt_lines(ingredients):
+    for item in ingredients:
+        yield (
+            f'{item["ingredient__name"]}: {item["total_amount"]} '
+            f'{item["ingredient__measurement_unit"]}\n'
         )
-    
-        return response_obj
\ No newline at end of file
+
+
+def csv_lines(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'amount', 'measurement_unit'))
+
+    for item in ingredients:
+        yield writer.writerow((
+            item['ingredient__name'],
+            item['total_amount'],
+            item['ingredient__measurement_unit'],
+        ))
+
+
+def json_lines(ingredients):
+    separator = ''
+    yield '['
+
+    for item in ingredients:
+        yield separator + json.dumps({
+            'name': item['ingredient__name'],
+            'amount': item['total_amount'],
+            'measurement_unit': item['ingredient__measurement_unit'],
+        }, ensure_ascii=False)
+        separator = ', '
+
+    yield ']'
+
+
+LINE_GENERATORS = {
+    'txt': txt_lines,
+    'csv': csv_lines,
+    'json': json_lines,
+}
+
+
+def shopping_cart_downloader(user, file_format='txt'):
+    ingredients = shopping_cart_ingredients(user).iterator()
+
+    response_obj = StreamingHttpResponse(
+        LINE_GENERATORS[file_format](ingredients),
+        content_type=SHOPPING_CART_FORMATS[file_format]
+    )
+    response_obj['Content-Disposition'] = (
+        f'attachment; filename="shopping_cart.{file_format}"'
+    )
+
+    return response_obj
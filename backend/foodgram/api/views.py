@@ -1,6 +1,9 @@
+from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from django.db.models import Avg
 from django.db.utils import IntegrityError
 from django_filters.rest_framework import DjangoFilterBackend
@@ -10,6 +13,8 @@ from rest_framework.views import APIView
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.renderers import JSONRenderer
+from rest_framework.parsers import JSONParser, MultiPartParser
 from rest_framework.permissions import (
     IsAuthenticated,
     AllowAny,
@@ -29,15 +34,30 @@ from .serializers import (
     TagSerializer,
     IngredientSerializer,
     RecipeSerializer,
-    PostRecipeSerializer
+    PostRecipeSerializer,
+    RecipeIdsSerializer,
+    FastRecipeSerializer
 )
-from .pagination import FoodgramPagination
+from .pagination import FoodgramPagination, FoodgramCursorPagination
 from .filters import (
     RecipeFilter,
     IngredientFilter,
 )
-from .utils import shopping_cart_downloader
-from users.models import Follow
+from .caching import (
+    CatalogCacheMixin,
+    PublicCacheMixin,
+    RecipeConditionalMixin,
+    RecipeListCacheMixin,
+)
+from .renderers import PlainTextRenderer, CSVRenderer
+from .utils import shopping_cart_downloader, SHOPPING_CART_FORMATS
+from .uploadhandlers import (
+    LimitedTemporaryFileUploadHandler,
+    check_request_size,
+)
+from users.models import Follow, count_subquery
+from recipes.search import ingredient_index, recipe_ingredient_index
+from recipes.similarity import NEIGHBORS_COUNT, similar_recipe_ids
 from recipes.models import (
     Ingredient,
     Tag,
@@ -49,6 +69,42 @@ from recipes.models import (
 
 User = get_user_model()
 
+
+def author_recipes_map(authors, limit_value=None):
+    '''
+    Рецепты авторов страницы подписок, сгруппированные по id автора.
+    '''
+    try:
+        limit = int(limit_value)
+    except (TypeError, ValueError):
+        limit = None
+
+    if limit is not None and limit <= 0:
+        limit = None
+
+    author_recipes = {author.id: [] for author in authors}
+    recipes = Recipe.objects.for_authors(author_recipes.keys(), limit)
+
+    for recipe in recipes:
+        author_recipes[recipe.author_id].append(recipe)
+
+    return author_recipes
+
+
+def parse_ids(values):
+    '''
+    id из повторяющегося параметра или списка через запятую.
+    '''
+    ids = []
+    for value in values:
+        for item in value.split(','):
+            item = item.strip()
+            if item:
+                ids.append(int(item))
+
+    return ids
+
+
 def objects_relations_manager(this, model, request, error, **kwargs):
     if request.method == 'DELETE':
         try:
@@ -73,6 +129,66 @@ def objects_relations_manager(this, model, request, error, **kwargs):
     return Response(context, status=status.HTTP_200_OK)
 
 
+@transaction.atomic
+def bulk_relations_manager(model, counter_field, request):
+    '''
+    Добавляет или удаляет список рецептов пользователя одним запросом
+    и возвращает результат для каждого id.
+    '''
+    serializer = RecipeIdsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    recipe_ids = list(dict.fromkeys(serializer.validated_data['recipes']))
+
+    user = request.user
+    relations = model.objects.filter(user=user, recipe_id__in=recipe_ids)
+
+    if request.method == 'DELETE':
+        # Строки блокируются до конца транзакции: параллельное удаление
+        # не попадет ни в статусы, ни в счетчики дважды. Счетчики
+        # уменьшают обработчики post_delete
+        linked = set(relations.select_for_update().values_list(
+            'recipe_id', flat=True
+        ))
+        relations.delete()
+        results = [
+            {
+                'id': recipe_id,
+                'status': 'removed' if recipe_id in linked else 'not_found'
+            }
+            for recipe_id in recipe_ids
+        ]
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    linked = set(relations.values_list('recipe_id', flat=True))
+    existing = set(Recipe.objects.filter(
+        id__in=recipe_ids
+    ).values_list('id', flat=True))
+    added = existing - linked
+
+    # Параллельный запрос мог успеть добавить ту же связь:
+    # такие строки пропускаются без IntegrityError
+    model.objects.bulk_create(
+        [model(user=user, recipe_id=recipe_id) for recipe_id in added],
+        ignore_conflicts=True
+    )
+    # bulk_create не вызывает сигналы, поэтому счетчики пересчитываются
+    Recipe.objects.filter(id__in=added).update(
+        **{counter_field: count_subquery(model, 'recipe')}
+    )
+
+    results = []
+    for recipe_id in recipe_ids:
+        if recipe_id not in existing:
+            outcome = 'not_found'
+        elif recipe_id in linked:
+            outcome = 'exists'
+        else:
+            outcome = 'added'
+        results.append({'id': recipe_id, 'status': outcome})
+
+    return Response({'results': results}, status=status.HTTP_200_OK)
+
+
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all().order_by('date_joined')
     serializer_class = UserSerializer
@@ -162,35 +278,118 @@ class UserViewSet(viewsets.ModelViewSet):
     )
     def subscribtions(self, request):
         user = request.user
-        followings = user.followings.all()
-        subscriptions = User.objects.filter(followers__in=followings).order_by('-id')
+        subscriptions = User.objects.filter(
+            followers__user=user
+        ).order_by('-id')
         page = self.paginate_queryset(subscriptions)
+        authors = page if page is not None else list(subscriptions)
+
+        context = self.get_serializer_context()
+        context['author_recipes'] = author_recipes_map(
+            authors, request.GET.get('recipes_limit')
+        )
+        serializer = SubscriptionSerializer(authors, many=True, context=context)
 
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response(serializer.data)
 
-        serializer = self.get_serializer(subscriptions, many=True)
-
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class FastRecipeReadMixin:
+    '''
+    list и retrieve через FastRecipeSerializer: строки values() вместо
+    моделей и вложенных DRF-сериализаторов. Отключается настройкой
+    RECIPE_FAST_SERIALIZER.
+    '''
+
+    def read_queryset(self):
+        return self.filter_queryset(
+            self.queryset.all().with_user_flags(self.request.user)
+        )
+
+    def list(self, request, *args, **kwargs):
+        if not settings.RECIPE_FAST_SERIALIZER:
+            return super().list(request, *args, **kwargs)
+
+        serializer = FastRecipeSerializer(self.get_serializer_context())
+        rows = serializer.rows(self.read_queryset())
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(serializer.serialize(page))
+
+        return Response(serializer.serialize(rows))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not settings.RECIPE_FAST_SERIALIZER:
+            return super().retrieve(request, *args, **kwargs)
+
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        serializer = FastRecipeSerializer(self.get_serializer_context())
+        rows = list(serializer.rows(self.read_queryset().filter(
+            pk=self.kwargs[lookup_url_kwarg]
+        )))
+        if not rows:
+            raise Http404
+
+        # Те же проверки, что и в get_object, на модели без лишних запросов
+        self.check_object_permissions(request, Recipe(
+            id=rows[0]['id'], author_id=rows[0]['author_id']
+        ))
+
+        return Response(serializer.serialize(rows)[0])
+
+
+class RecipeViewSet(PublicCacheMixin, RecipeListCacheMixin,
+                    RecipeConditionalMixin, FastRecipeReadMixin,
+                    viewsets.ModelViewSet):
     queryset = Recipe.objects.get_queryset().order_by('-id')
     serializer_class = RecipeSerializer
     pagination_class = FoodgramPagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    parser_classes = (JSONParser, MultiPartParser)
+    lookup_value_regex = r'\d+'
+
+    def initialize_request(self, request, *args, **kwargs):
+        # Файлы из multipart-формы пишутся во временный файл частями,
+        # не занимая память воркера
+        request.upload_handlers = [LimitedTemporaryFileUploadHandler(request)]
+
+        return super().initialize_request(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        check_request_size(request)
+
+    def perform_content_negotiation(self, request, force=False):
+        # Неизвестный ?format у выгрузки доходит до представления
+        # и получает 400 со списком форматов вместо 404
+        return super().perform_content_negotiation(
+            request,
+            force=force or self.action == 'download_shopping_cart'
+        )
 
     def get_permissions(self):
         if self.action in ['list', 'get']:
             permission_classes = [AllowAny, ]
-        elif self.action == 'post':
+        elif self.action in [
+            'post', 'feed', 'favorite_many', 'shopping_cart_many'
+        ]:
             permission_classes = [IsAuthenticated, ]
         else:
             permission_classes = [IsAuthorOrReadOnly, ]
 
         return [permission() for permission in permission_classes]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        if self.request.method in SAFE_METHODS:
+            return queryset.for_read().with_user_flags(self.request.user)
+
+        return queryset
     
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
@@ -234,21 +433,144 @@ class RecipeViewSet(viewsets.ModelViewSet):
             self, ShoppingCart, request, error_msg, user=user, recipe=recipe
         )
     
+    @action(
+        methods=['get',],
+        detail=False,
+        url_path='available'
+    )
+    def available(self, request):
+        try:
+            ingredient_ids = parse_ids(
+                request.query_params.getlist('ingredients')
+            )
+        except ValueError:
+            ingredient_ids = None
+
+        if not ingredient_ids:
+            error = {
+                'error': 'Укажите id имеющихся ингредиентов в ingredients'
+            }
+            return Response(error, status=status.HTTP_400_BAD_REQUEST)
+
+        ranked = recipe_ingredient_index.rank(ingredient_ids)
+        page = self.paginate_queryset(ranked)
+        if page is None:
+            page = ranked
+
+        recipes = Recipe.objects.for_read().with_user_flags(
+            request.user
+        ).in_bulk([recipe_id for recipe_id, _ in page])
+
+        data = []
+        for recipe_id, coverage in page:
+            # Рецепт мог быть удален после последнего обновления индекса
+            if recipe_id not in recipes:
+                continue
+
+            item = self.get_serializer(recipes[recipe_id]).data
+            item['coverage'] = round(coverage, 2)
+            data.append(item)
+
+        if self.paginator is not None:
+            return self.get_paginated_response(data)
+
+        return Response(data, status=status.HTTP_200_OK)
+
+    @action(
+        methods=['get',],
+        detail=False,
+        url_path='feed',
+        pagination_class=FoodgramCursorPagination
+    )
+    def feed(self, request):
+        recipes = self.filter_queryset(self.get_queryset()).filter(
+            author__in=Follow.objects.filter(
+                user=request.user
+            ).values('author')
+        )
+        page = self.paginate_queryset(recipes)
+        serializer = self.get_serializer(page, many=True)
+
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        methods=['get',],
+        detail=True,
+        url_path='similar'
+    )
+    def similar(self, request, pk):
+        similar_ids = similar_recipe_ids(pk)
+        if not similar_ids:
+            get_object_or_404(Recipe, pk=pk)
+
+        try:
+            limit = min(int(request.query_params['limit']), NEIGHBORS_COUNT)
+        except (KeyError, ValueError):
+            limit = NEIGHBORS_COUNT
+
+        similar_ids = similar_ids[:max(limit, 0)]
+        recipes = Recipe.objects.for_read().with_user_flags(
+            request.user
+        ).in_bulk(similar_ids)
+
+        serializer = self.get_serializer(
+            [recipes[recipe_id] for recipe_id in similar_ids
+             if recipe_id in recipes],
+            many=True
+        )
+
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(
+        methods=['post', 'delete'],
+        detail=False,
+        url_path='favorite'
+    )
+    def favorite_many(self, request):
+        return bulk_relations_manager(Favorite, 'favorites_count', request)
+
+    @action(
+        methods=['post', 'delete'],
+        detail=False,
+        url_path='shopping_cart'
+    )
+    def shopping_cart_many(self, request):
+        return bulk_relations_manager(
+            ShoppingCart, 'in_carts_count', request
+        )
+
     @action(
         methods=['get',],
         detail=False,
         url_path='download_shopping_cart',
-        permission_classes=(IsAuthenticated,)
+        permission_classes=(IsAuthenticated,),
+        renderer_classes=(PlainTextRenderer, CSVRenderer, JSONRenderer)
     )
     def download_shopping_cart(self, request):
-        user = request.user
-        shopping_cart_objects = user.shopping_cart.all()
-        
-        return shopping_cart_downloader(shopping_cart_objects)
+        # ?format оставлен для совместимости, но его перехватывает
+        # согласование формата DRF (URL_FORMAT_OVERRIDE)
+        file_format = request.query_params.get(
+            'file_format', request.query_params.get('format', 'txt')
+        )
+
+        if file_format not in SHOPPING_CART_FORMATS:
+            error = {
+                'error': (
+                    'Доступные значения file_format: '
+                    + ', '.join(SHOPPING_CART_FORMATS)
+                )
+            }
+            request.accepted_renderer = JSONRenderer()
+            request.accepted_media_type = JSONRenderer.media_type
+            return Response(error, status=status.HTTP_400_BAD_REQUEST)
+
+        return shopping_cart_downloader(request.user, file_format)
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(PublicCacheMixin, CatalogCacheMixin,
+                 viewsets.ModelViewSet):
     queryset = Tag.objects.all()
+    public_cache_max_age = settings.PUBLIC_CATALOG_CACHE_MAX_AGE
     pagination_class = None
     serializer_class = TagSerializer
 
@@ -261,8 +583,10 @@ class TagViewSet(viewsets.ModelViewSet):
         return [permission() for permission in permission_classes]
 
 
-class IngredientViewSet(viewsets.ModelViewSet):
+class IngredientViewSet(PublicCacheMixin, CatalogCacheMixin,
+                        viewsets.ModelViewSet):
     queryset = Ingredient.objects.all()
+    public_cache_max_age = settings.PUBLIC_CATALOG_CACHE_MAX_AGE
     serializer_class = IngredientSerializer
     pagination_class = None
     filter_backends = (DjangoFilterBackend,)
@@ -275,3 +599,12 @@ class IngredientViewSet(viewsets.ModelViewSet):
             permission_classes = [OnlyForAdmin, ]
 
         return [permission() for permission in permission_classes]
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+
+        # Автодополнение обслуживается индексом в памяти без запросов к БД
+        if name:
+            return Response(ingredient_index.search(name))
+
+        return super().list(request, *args, **kwargs)
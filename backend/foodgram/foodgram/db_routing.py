@@ -0,0 +1,111 @@
+import hashlib
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+PRIMARY_DB = 'default'
+PINNED_CACHE_KEY = 'db-pinned:{}'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Реплики используются только API: админка читает то, что только что
+# записала, и должна видеть это сразу
+REPLICA_PATH_PREFIX = '/api/'
+
+# Токены проверяются по основной базе: только что выданный токен
+# может еще не дойти до реплики
+PRIMARY_ONLY_APPS = ('authtoken',)
+
+_state = threading.local()
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias != PRIMARY_DB]
+
+
+@contextmanager
+def primary_reads():
+    '''
+    Чтение из основной базы внутри блока. Нужно там, где прочитанное
+    кладется в кеш до следующего изменения: данные с отстающей реплики
+    остались бы в нем надолго.
+    '''
+    replica = getattr(_state, 'replica', None)
+    _state.replica = None
+    try:
+        yield
+    finally:
+        _state.replica = replica
+
+
+class PrimaryReplicaRouter:
+    '''
+    Запись всегда идет в основную базу, чтение в реплику, выбранную
+    на весь запрос, но только внутри безопасных запросов к API
+    (см. ReplicaMiddleware).
+    Команды, воркеры и запросы на изменение читают из основной базы.
+    '''
+
+    def db_for_read(self, model, **hints):
+        replica = getattr(_state, 'replica', None)
+        if replica is None or model._meta.app_label in PRIMARY_ONLY_APPS:
+            return PRIMARY_DB
+
+        return replica
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY_DB
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY_DB
+
+
+def pinned_cache_key(request):
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    if not authorization:
+        return None
+
+    return PINNED_CACHE_KEY.format(
+        hashlib.sha256(authorization.encode()).hexdigest()
+    )
+
+
+class ReplicaMiddleware:
+    '''
+    Выбирает одну случайную реплику на весь безопасный запрос к API,
+    и все чтения запроса идут в нее, а не в разные реплики. Клиент,
+    который только что что-то изменил, на REPLICA_PIN_SECONDS
+    закрепляется за основной базой и сразу видит свои изменения.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        replicas = replica_aliases()
+        if not replicas or not request.path.startswith(REPLICA_PATH_PREFIX):
+            return self.get_response(request)
+
+        key = pinned_cache_key(request)
+        if request.method in SAFE_METHODS and (
+            key is None or not cache.get(key)
+        ):
+            _state.replica = random.choice(replicas)
+
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.replica = None
+
+        if (
+            key is not None
+            and request.method not in SAFE_METHODS
+            and response.status_code < 400
+        ):
+            cache.set(key, True, settings.REPLICA_PIN_SECONDS)
+
+        return response
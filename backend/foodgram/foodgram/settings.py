@@ -43,6 +43,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'foodgram.db_routing.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -82,6 +83,56 @@ DATABASES = {
     }
 }
 
+# Реплики только для чтения: DB_REPLICAS=host1,host2
+# (для SQLite — пути к файлам, например для локальной проверки)
+DB_REPLICAS = [
+    replica.strip() for replica in os.getenv('DB_REPLICAS', '').split(',')
+    if replica.strip()
+]
+
+for number, replica in enumerate(DB_REPLICAS):
+    replica_key = (
+        'NAME' if DATABASES['default']['ENGINE'].endswith('sqlite3')
+        else 'HOST'
+    )
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        replica_key: replica,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['foodgram.db_routing.PrimaryReplicaRouter']
+
+# Сколько секунд после изменения клиент читает из основной базы
+REPLICA_PIN_SECONDS = 5
+
+
+# Cache
+# Кеш должен быть общим для всех воркеров и контейнеров: в нем хранятся
+# версии справочников, токены, закрепления за основной базой и страницы.
+# В docker-compose это memcached. Файловый кеш по умолчанию подходит только
+# для локальной разработки: incr и add в нем не атомарны.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION', default='/var/tmp/foodgram_cache'
+        ),
+        # Для файлового кеша: по умолчанию после 300 файлов он удаляет
+        # случайную треть записей
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    }
+}
+
+# Время жизни готовых ответов справочников одной версии
+CATALOG_CACHE_TIMEOUT = 24 * 60 * 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -105,7 +156,7 @@ AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -113,12 +164,30 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination'
 }
 
+# Время жизни закешированной связки токен -> пользователь
+AUTH_TOKEN_CACHE_TIMEOUT = 5 * 60
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
 }
 
 PAGINATION_PAGE_SIZE = 6
 
+# Время жизни закешированного количества объектов в cursor-пагинации
+PAGINATION_COUNT_CACHE_TIMEOUT = 60
+
+# Время жизни закешированных страниц списка рецептов для анонимов
+RECIPE_LIST_CACHE_TIMEOUT = 5 * 60
+
+# Cache-Control для ответов анонимам: время жизни в кеше прокси
+# и сколько еще можно отдавать устаревший ответ, обновляя его в фоне
+PUBLIC_CACHE_MAX_AGE = 10
+PUBLIC_CACHE_STALE_WHILE_REVALIDATE = 30
+PUBLIC_CATALOG_CACHE_MAX_AGE = 60
+
+# Чтение рецептов (list/retrieve) через FastRecipeSerializer
+RECIPE_FAST_SERIALIZER = True
+
 # Internationalization
 # https://docs.djangoproject.com/en/2.2/topics/i18n/
 
@@ -141,3 +210,16 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+
+# Ограничения загружаемых изображений рецептов
+RECIPE_IMAGE_MAX_SIZE = 10 * 1024 * 1024
+# Тело запроса с рецептом: изображение в base64 и остальные поля
+RECIPE_REQUEST_MAX_SIZE = RECIPE_IMAGE_MAX_SIZE * 4 // 3 + 1024 * 1024
+RECIPE_IMAGE_MAX_DIMENSION = 6000
+
+# Размеры уменьшенных копий изображений рецептов (ширина, высота)
+RECIPE_IMAGE_SIZES = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'detail': (1200, 1200),
+}
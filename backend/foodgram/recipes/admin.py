@@ -6,7 +6,8 @@ from .models import (
     Recipe,
     Favorite,
     ShoppingCart,
-    IngredientRecipeRelation
+    IngredientRecipeRelation,
+    touch_recipe_ingredients
 )
 
 EMPTY = '-пусто-'
@@ -60,6 +61,19 @@ class IngredientAdmin(admin.ModelAdmin):
     list_filter = ('measurement_unit',)
     empty_value_display = EMPTY
 
+    def save_formset(self, request, form, formset, change):
+        super().save_formset(request, form, formset, change)
+
+        if formset.model is IngredientRecipeRelation:
+            relations = (
+                formset.new_objects
+                + [relation for relation, _ in formset.changed_objects]
+                + formset.deleted_objects
+            )
+            touch_recipe_ingredients(
+                *{relation.recipe_id for relation in relations}
+            )
+
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
@@ -69,11 +83,15 @@ class RecipeAdmin(admin.ModelAdmin):
         'author',
         'image',
         'text',
-        'cooking_time'
+        'cooking_time',
+        'favorites_count',
+        'in_carts_count',
     )
 
     inlines = (TagInline, IngredientInline)
 
+    readonly_fields = ('favorites_count', 'in_carts_count')
+
     list_editable = (
         'name', 'author', 'image', 'text', 'cooking_time'
     )
@@ -97,6 +115,23 @@ class IngredientRecipeRelation(admin.ModelAdmin):
 
     empty_value_display = EMPTY
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+
+        recipe_ids = {obj.recipe_id}
+        if form.initial.get('recipe'):
+            recipe_ids.add(form.initial['recipe'])
+        touch_recipe_ingredients(*recipe_ids)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        touch_recipe_ingredients(obj.recipe_id)
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = set(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        touch_recipe_ingredients(*recipe_ids)
+
 
 @admin.register(Favorite)
 class FavoriteAdmin(admin.ModelAdmin):
@@ -0,0 +1,119 @@
+import hashlib
+import io
+import os
+import threading
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from PIL import Image
+
+IMAGES_DIR = 'recipes/images/'
+
+DERIVATIVES_DIR = 'recipes/derivatives/'
+DERIVATIVE_FORMATS = {
+    'webp': 'WEBP',
+    'jpeg': 'JPEG',
+}
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранилище, в котором имя файла определяется его содержимым:
+    одинаковые загрузки сохраняются один раз, а URL никогда не меняется.
+    """
+
+    _saving = threading.local()
+
+    def get_available_name(self, name, max_length=None):
+        if getattr(self._saving, 'active', False):
+            # Повторный вызов из цикла FileSystemStorage._save: тот же
+            # файл уже записала параллельная загрузка. Цикл получил бы
+            # то же имя и повторял попытки бесконечно
+            raise FileExistsError(name)
+
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            return name
+
+        self._saving.active = True
+        try:
+            return super()._save(name, content)
+        except FileExistsError:
+            # Содержимое совпадает по построению имени
+            return name
+        finally:
+            self._saving.active = False
+
+
+def recipe_image_path(instance, filename):
+    sha256 = hashlib.sha256()
+    for chunk in instance.image.chunks():
+        sha256.update(chunk)
+
+    digest = sha256.hexdigest()
+    extension = os.path.splitext(filename)[1].lower()
+
+    return f'{IMAGES_DIR}{digest[:2]}/{digest}{extension}'
+
+
+def derivative_name(image_name, size, extension):
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return f'{DERIVATIVES_DIR}{stem}_{size}.{extension}'
+
+
+def derivative_names(image_name):
+    return [
+        derivative_name(image_name, size, extension)
+        for size in settings.RECIPE_IMAGE_SIZES
+        for extension in DERIVATIVE_FORMATS
+    ]
+
+
+def derivative_urls(image_name):
+    return {
+        size: {
+            extension: default_storage.url(
+                derivative_name(image_name, size, extension)
+            )
+            for extension in DERIVATIVE_FORMATS
+        }
+        for size in settings.RECIPE_IMAGE_SIZES
+    }
+
+
+def make_derivatives(image_name):
+    '''
+    Создает уменьшенные копии изображения рецепта во всех форматах.
+    '''
+    with default_storage.open(image_name) as image_file:
+        original = Image.open(image_file)
+        original.load()
+
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA')
+
+    for size, dimensions in settings.RECIPE_IMAGE_SIZES.items():
+        resized = original.copy()
+        resized.thumbnail(dimensions, Image.LANCZOS)
+
+        for extension, image_format in DERIVATIVE_FORMATS.items():
+            image = resized
+            if image_format == 'JPEG' and image.mode != 'RGB':
+                image = image.convert('RGB')
+
+            buffer = io.BytesIO()
+            image.save(buffer, image_format, quality=82, optimize=True)
+
+            name = derivative_name(image_name, size, extension)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def delete_derivatives(image_name):
+    for name in derivative_names(image_name):
+        if default_storage.exists(name):
+            default_storage.delete(name)
@@ -0,0 +1,69 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.images import make_derivatives
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Создает уменьшенные копии изображений рецептов, '
+        'которые еще не обработаны'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Работать постоянно, проверяя новые изображения'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=5,
+            help='Пауза между проверками в секундах'
+        )
+        parser.add_argument(
+            '--batch', type=int, default=50,
+            help='Количество рецептов за один проход'
+        )
+
+    def process_batch(self, batch):
+        pending = Recipe.objects.filter(
+            image_processed=False, image_failed=False
+        ).values_list('id', 'image')[:batch]
+        processed = failed = 0
+
+        for recipe_id, image_name in pending:
+            try:
+                make_derivatives(image_name)
+            except (OSError, ValueError) as error:
+                self.stderr.write(f'Рецепт {recipe_id}: {error}')
+                # Иначе битые изображения выбирались бы в каждый проход
+                # и занимали бы всю пачку
+                Recipe.objects.filter(
+                    id=recipe_id, image=image_name
+                ).update(image_failed=True)
+                failed += 1
+                continue
+
+            # Изображение могло смениться, пока шла обработка.
+            # updated меняется, чтобы сменились ETag и Last-Modified рецепта
+            processed += Recipe.objects.filter(
+                id=recipe_id, image=image_name
+            ).update(image_processed=True, updated=timezone.now())
+
+        return processed, failed
+
+    def handle(self, *args, **options):
+        while True:
+            processed, failed = self.process_batch(options['batch'])
+            if processed:
+                # В ответах появились ссылки на копии изображений
+                Recipe.bump_catalog_version()
+                self.stdout.write(f'Обработано изображений: {processed}')
+
+            if not options['loop']:
+                break
+
+            if processed + failed < options['batch']:
+                time.sleep(options['interval'])
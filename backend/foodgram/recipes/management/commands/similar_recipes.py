@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.similarity import update_neighbors
+
+
+class Command(BaseCommand):
+    help = (
+        'Рассчитывает списки похожих рецептов для измененных рецептов '
+        'и рецептов, которые от них зависят'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Пересчитать списки всех рецептов'
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Работать постоянно, проверяя измененные рецепты'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=60,
+            help='Пауза между проверками в секундах'
+        )
+        parser.add_argument(
+            '--batch', type=int, default=500,
+            help='Количество рецептов, сохраняемых в одной транзакции'
+        )
+
+    def handle(self, *args, **options):
+        full = options['full']
+
+        while True:
+            updated = update_neighbors(full=full, batch=options['batch'])
+            if updated:
+                self.stdout.write(f'Пересчитано рецептов: {updated}')
+
+            if not options['loop']:
+                break
+
+            full = False
+            time.sleep(options['interval'])
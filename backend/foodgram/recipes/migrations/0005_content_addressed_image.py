@@ -0,0 +1,19 @@
+# Generated by Django 2.2.19 on 2026-10-17 13:00
+
+from django.db import migrations, models
+import recipes.images
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_recipe_image_processed'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(db_index=True, storage=recipes.images.ContentAddressedStorage(), upload_to=recipes.images.recipe_image_path),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.19 on 2026-10-17 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_failed',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -1,14 +1,37 @@
 import os
+import uuid
+from datetime import timedelta
+
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.functions import Greatest
 from django.utils.html import format_html
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.dispatch import receiver
+from django.utils import timezone
+
+from foodgram.db_routing import primary_reads
+from users.models import CountersMixin
+
+from .images import (
+    IMAGES_DIR,
+    ContentAddressedStorage,
+    delete_derivatives,
+    recipe_image_path,
+)
 
 
 User = get_user_model()
 
+TAG_SLUGS_CACHE_KEY = 'tag-slugs'
+TAG_SLUGS_CACHE_TIMEOUT = 60 * 60
+RECIPE_CHANGES_TIMEOUT = 24 * 60 * 60
+RECIPE_CHANGES_PRUNE_EVERY = 1000
+SIMILAR_RECIPES_CACHE_KEY = 'similar-recipes:{}'
+
 
 def validate_color(color_code):
     if color_code[0] != '#':
@@ -29,7 +52,28 @@ def validate_color(color_code):
         )
 
 
-class Tag(models.Model):
+class CatalogVersionMixin:
+    """
+    Версия справочника в кеше, меняется при любом его изменении.
+    """
+    catalog_version_key = None
+
+    @classmethod
+    def catalog_version(cls):
+        version = cache.get(cls.catalog_version_key)
+        if version is None:
+            version = cls.bump_catalog_version()
+
+        return version
+
+    @classmethod
+    def bump_catalog_version(cls):
+        version = uuid.uuid4().hex
+        cache.set(cls.catalog_version_key, version, None)
+        return version
+
+
+class Tag(CatalogVersionMixin, models.Model):
     name = models.CharField(max_length=200, unique=True)
     slug = models.SlugField(max_length=50, unique=True)
     color = models.CharField(
@@ -38,6 +82,23 @@ class Tag(models.Model):
         validators=[validate_color],
     )
 
+    catalog_version_key = 'tags-version'
+
+    @classmethod
+    def cached_slugs(cls):
+        """
+        Словарь slug -> id всех тегов, хранится в кеше до изменения тегов,
+        но не дольше часа: запрос, прочитавший теги до коммита изменения,
+        может положить в кеш старый словарь.
+        """
+        slugs = cache.get(TAG_SLUGS_CACHE_KEY)
+        if slugs is None:
+            with primary_reads():
+                slugs = dict(cls.objects.values_list('slug', 'id'))
+            cache.set(TAG_SLUGS_CACHE_KEY, slugs, TAG_SLUGS_CACHE_TIMEOUT)
+
+        return slugs
+
     def colored_name(self):
         return format_html(
             '<span style="color: {};">{}</span>',
@@ -48,21 +109,82 @@ class Tag(models.Model):
         ordering = ['id']
 
 
-class Ingredient(models.Model):
+class Ingredient(CatalogVersionMixin, models.Model):
     name = models.CharField(max_length=200)
     measurement_unit = models.CharField(max_length=32)
 
+    catalog_version_key = 'ingredients-version'
+
     class Meta:
         ordering = ['id']
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+    def for_read(self):
+        """
+        Подгружает автора, теги и ингредиенты заранее фиксированным
+        числом запросов, независимо от количества рецептов.
+        """
+        return self.select_related('author').prefetch_related(
+            'tags',
+            models.Prefetch(
+                'ingredientreciperelation_set',
+                queryset=IngredientRecipeRelation.objects.select_related(
+                    'ingredient'
+                ).order_by('id')
+            )
+        )
+
+    def with_user_flags(self, user):
+        """
+        Добавляет флаги favorited и in_cart для текущего пользователя
+        подзапросами EXISTS вместо отдельного запроса на каждый рецепт.
+        """
+        if user.is_anonymous:
+            return self
+
+        return self.annotate(
+            favorited=models.Exists(Favorite.objects.filter(
+                user=user, recipe=models.OuterRef('pk')
+            )),
+            in_cart=models.Exists(ShoppingCart.objects.filter(
+                user=user, recipe=models.OuterRef('pk')
+            )),
+        )
+
+    def for_authors(self, authors, limit=None):
+        """
+        Рецепты нескольких авторов одним запросом.
+        При заданном limit отбор делается подзапросом с LIMIT на автора.
+        """
+        queryset = self.filter(author__in=authors)
+
+        if limit is not None:
+            first_ids = self.filter(
+                author=models.OuterRef('author')
+            ).order_by('id').values('id')[:limit]
+            queryset = queryset.filter(id__in=models.Subquery(first_ids))
+
+        return queryset.order_by('author', 'id')
+
+
+class Recipe(CatalogVersionMixin, CountersMixin, models.Model):
     name = models.CharField(max_length=200, unique=True)
     author = models.ForeignKey(
         User, on_delete=models.CASCADE,
         related_name='recipes'
     )
-    image = models.ImageField(upload_to='recipes/images/')
+    image = models.ImageField(
+        upload_to=recipe_image_path,
+        storage=ContentAddressedStorage(),
+        db_index=True
+    )
+    image_processed = models.BooleanField(default=False)
+    # Копии не удалось создать, process_images больше не берет рецепт
+    # до смены изображения
+    image_failed = models.BooleanField(default=False)
+    favorites_count = models.PositiveIntegerField(default=0)
+    in_carts_count = models.PositiveIntegerField(default=0)
     text = models.TextField(max_length=5000)
     cooking_time = models.PositiveSmallIntegerField(
         validators=[MinValueValidator(1)]
@@ -73,6 +195,20 @@ class Recipe(models.Model):
         through='IngredientRecipeRelation',
         related_name='recipes',
     )
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    # Заполняется триггером в PostgreSQL, см. миграцию 0007
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Время последнего расчета похожих рецептов, см. команду similar_recipes
+    neighbors_updated = models.DateTimeField(null=True, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
+
+    counter_fields = ('favorites_count', 'in_carts_count')
+    # Поколение списка рецептов для кеша ответов анонимам
+    catalog_version_key = 'recipes-version'
+    # Поля автора, которые попадают в ответ рецепта
+    AUTHOR_FIELDS = ('username', 'email', 'first_name', 'last_name')
 
     def is_favorited(self, user):
         return Favorite.objects.filter(user=user, recipe=self).exists()
@@ -82,6 +218,13 @@ class Recipe(models.Model):
 
     class Meta:
         ordering = ['id']
+        indexes = (
+            # Лента подписок: рецепты авторов по убыванию id
+            models.Index(
+                fields=['author', '-id'],
+                name='recipe_author_id_idx'
+            ),
+        )
 
 
 class IngredientRecipeRelation(models.Model):
@@ -150,24 +293,253 @@ class ShoppingCart(models.Model):
         ]
 
 
+class SimilarRecipe(models.Model):
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='neighbors'
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_to'
+    )
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['recipe', '-score', 'similar']
+        constraints = (
+            models.UniqueConstraint(
+                fields=['recipe', 'similar'],
+                name='similar_recipe'
+            ),
+        )
+
+
+class RecipeChange(models.Model):
+    """
+    Журнал измененных рецептов: по нему индексы в памяти воркеров
+    обновляются инкрементально, а не перестраиваются целиком.
+    Номер записи выдает база, поэтому параллельные записи не теряются.
+    """
+    recipe_id = models.PositiveIntegerField()
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+@receiver(models.signals.post_save, sender=Tag)
+@receiver(models.signals.post_delete, sender=Tag)
+def reset_tag_slugs_cache(sender, **kwargs):
+    # После коммита, иначе параллельный запрос закеширует старый
+    # справочник уже под новой версией
+    transaction.on_commit(lambda: cache.delete(TAG_SLUGS_CACHE_KEY))
+    transaction.on_commit(Tag.bump_catalog_version)
+
+
+@receiver(models.signals.post_save, sender=Ingredient)
+@receiver(models.signals.post_delete, sender=Ingredient)
+def bump_ingredients_version(sender, **kwargs):
+    transaction.on_commit(Ingredient.bump_catalog_version)
+
+
+def change_counter(model, pk, field, delta):
+    # Не даем счетчику уйти ниже нуля при расхождении с данными
+    model.objects.filter(pk=pk).update(
+        **{field: Greatest(models.F(field) + delta, 0)}
+    )
+
+
+@receiver(models.signals.post_save, sender=Favorite)
+def increase_favorites_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, 'favorites_count', 1)
+
+
+@receiver(models.signals.post_delete, sender=Favorite)
+def decrease_favorites_count(sender, instance, **kwargs):
+    change_counter(Recipe, instance.recipe_id, 'favorites_count', -1)
+
+
+@receiver(models.signals.post_save, sender=ShoppingCart)
+def increase_in_carts_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, 'in_carts_count', 1)
+
+
+@receiver(models.signals.post_delete, sender=ShoppingCart)
+def decrease_in_carts_count(sender, instance, **kwargs):
+    change_counter(Recipe, instance.recipe_id, 'in_carts_count', -1)
+
+
+@receiver(models.signals.post_save, sender=Recipe)
+def increase_recipes_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(User, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(models.signals.post_delete, sender=Recipe)
+def decrease_recipes_count(sender, instance, **kwargs):
+    change_counter(User, instance.author_id, 'recipes_count', -1)
+
+
+def record_recipe_change(recipe_id):
+    change = RecipeChange.objects.create(recipe_id=recipe_id)
+
+    if change.pk % RECIPE_CHANGES_PRUNE_EVERY == 0:
+        RecipeChange.objects.filter(
+            created__lt=timezone.now() - timedelta(
+                seconds=RECIPE_CHANGES_TIMEOUT
+            )
+        ).delete()
+
+
+@receiver(models.signals.post_save, sender=Recipe)
 @receiver(models.signals.post_delete, sender=Recipe)
-def auto_delete_file_on_delete(sender, instance, **kwargs):
-    if instance.image:
-        if os.path.isfile(instance.image.path):
-            os.remove(instance.image.path)
+def log_recipe_change(sender, instance, **kwargs):
+    recipe_id = instance.pk
+    transaction.on_commit(lambda: record_recipe_change(recipe_id))
+
+
+def bump_recipes_version():
+    # После коммита, иначе параллельный запрос закеширует старые данные
+    # уже под новым поколением
+    transaction.on_commit(Recipe.bump_catalog_version)
+
+
+@receiver(models.signals.post_save, sender=Recipe)
+@receiver(models.signals.post_delete, sender=Recipe)
+def bump_recipes_version_on_change(sender, **kwargs):
+    bump_recipes_version()
+
+
+def touch_recipes(*recipe_ids):
+    Recipe.objects.filter(pk__in=recipe_ids).update(updated=timezone.now())
+    bump_recipes_version()
+
+
+def author_data(user):
+    return tuple(user.__dict__.get(field) for field in Recipe.AUTHOR_FIELDS)
+
+
+@receiver(models.signals.post_init, sender=User)
+def remember_author_data(sender, instance, **kwargs):
+    instance._original_author_data = author_data(instance)
+
+
+@receiver(models.signals.post_save, sender=User)
+def touch_author_recipes(sender, instance, created, **kwargs):
+    """
+    Данные автора входят в ответ рецепта, поэтому при их смене
+    меняются ETag и Last-Modified его рецептов. Смена пароля,
+    last_login и прочих полей рецепты не трогает.
+    """
+    original_data = instance._original_author_data
+    instance._original_author_data = author_data(instance)
+
+    if created or original_data == instance._original_author_data:
+        return
+
+    touched = Recipe.objects.filter(author=instance).update(
+        updated=timezone.now()
+    )
+    if touched:
+        bump_recipes_version()
+
+
+@receiver(models.signals.m2m_changed, sender=Recipe.tags.through)
+def touch_recipe_on_tags_change(sender, instance, action, reverse, pk_set,
+                                **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        touch_recipes(instance.pk)
+    elif pk_set:
+        touch_recipes(*pk_set)
+
+
+def touch_recipe_ingredients(*recipe_ids):
+    """
+    Для правок связей с ингредиентами в обход рецепта (из админки).
+    API сохраняет сам рецепт после применения разницы,
+    поэтому сигналов на каждую связь нет.
+    """
+    touch_recipes(*recipe_ids)
+    for recipe_id in recipe_ids:
+        transaction.on_commit(
+            lambda recipe_id=recipe_id: record_recipe_change(recipe_id)
+        )
+
+
+def delete_unused_image(image_name):
+    if Recipe.objects.filter(image=image_name).exists():
+        return
+
+    storage = Recipe._meta.get_field('image').storage
+    if storage.exists(image_name):
+        storage.delete(image_name)
+
+    # Копии называются по хешу без расширения: то же содержимое могло
+    # быть загружено с другим расширением и используется другим рецептом
+    base = os.path.splitext(image_name)[0]
+    if not Recipe.objects.filter(
+        models.Q(image=base) | models.Q(image__startswith=f'{base}.')
+    ).exists():
+        delete_derivatives(image_name)
+
+
+def release_image(image_name):
+    '''
+    После коммита удаляет файл изображения и его копии, если на него
+    больше не ссылается ни один рецепт. При откате транзакции
+    рецепт по-прежнему ссылается на файл, и он остается на месте.
+    '''
+    if image_name:
+        transaction.on_commit(lambda: delete_unused_image(image_name))
+
+
+@receiver(models.signals.pre_delete, sender=Recipe)
+def mark_neighbors_stale(sender, instance, **kwargs):
+    '''
+    Рецепты, у которых удаляемый был среди похожих,
+    пересчитываются при следующем запуске similar_recipes.
+    '''
+    stale_ids = list(SimilarRecipe.objects.filter(
+        similar=instance
+    ).values_list('recipe_id', flat=True))
+    Recipe.objects.filter(pk__in=stale_ids).update(neighbors_updated=None)
+
+    cache.delete_many([
+        SIMILAR_RECIPES_CACHE_KEY.format(recipe_id)
+        for recipe_id in stale_ids + [instance.pk]
+    ])
+
+
+@receiver(models.signals.post_init, sender=Recipe)
+def remember_original_image(sender, instance, **kwargs):
+    image = instance.__dict__.get('image')
+    instance._original_image = getattr(image, 'name', image)
 
 
 @receiver(models.signals.pre_save, sender=Recipe)
-def auto_delete_file_on_change(sender, instance, **kwargs):
-    if not instance.pk:
-        return False
+def reset_image_processed(sender, instance, **kwargs):
+    if instance.pk and instance.image.name != instance._original_image:
+        instance.image_processed = False
+        instance.image_failed = False
 
-    try:
-        old_file = Recipe.objects.get(pk=instance.pk).image
-    except Recipe.DoesNotExist:
-        return False
-
-    new_file = instance.image
-    if not old_file == new_file:
-        if os.path.isfile(old_file.path):
-            os.remove(old_file.path)
+
+@receiver(models.signals.post_save, sender=Recipe)
+def release_replaced_image(sender, instance, created, **kwargs):
+    original_image = instance._original_image
+    instance._original_image = instance.image.name
+
+    # При создании здесь имя файла от клиента, а не сохраненный файл
+    if created or not (original_image or '').startswith(IMAGES_DIR):
+        return
+
+    if original_image != instance.image.name:
+        release_image(original_image)
+
+
+@receiver(models.signals.post_delete, sender=Recipe)
+def release_image_on_delete(sender, instance, **kwargs):
+    release_image(instance.image.name)
@@ -0,0 +1,331 @@
+import html
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import timedelta
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import (
+    Case, F, Func, IntegerField, Max, Q, TextField, Value, When
+)
+from django.utils import timezone
+
+from foodgram.db_routing import primary_reads
+
+from .models import (
+    RECIPE_CHANGES_TIMEOUT,
+    Ingredient,
+    IngredientRecipeRelation,
+    Recipe,
+    RecipeChange,
+)
+
+SEARCH_CONFIG = 'russian'
+# ts_headline не экранирует текст, поэтому совпадения отмечаются
+# управляющими символами, а экранирование и <b> делаются в snippets
+SNIPPET_START, SNIPPET_STOP = '\x02', '\x03'
+SNIPPET_OPTIONS = (
+    f'StartSel="{SNIPPET_START}", StopSel="{SNIPPET_STOP}", '
+    'MaxWords=35, MinWords=15'
+)
+SNIPPET_RADIUS = 80
+
+
+class IngredientIndex:
+    """
+    Индекс ингредиентов для автодополнения в памяти воркера.
+    Сначала возвращаются совпадения по началу названия,
+    затем по подстроке. Перестраивается при смене версии каталога.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._data = ([], [], {})
+
+    def build(self, rows):
+        rows = sorted(rows, key=lambda row: (row['name'].lower(), row['id']))
+        names = [row['name'].lower() for row in rows]
+        trigrams = {}
+
+        for position, name in enumerate(names):
+            for start in range(len(name) - 2):
+                trigrams.setdefault(name[start:start + 3], set()).add(
+                    position
+                )
+
+        self._data = (rows, names, trigrams)
+
+    def refresh(self):
+        version = Ingredient.catalog_version()
+        if version == self._version:
+            return
+
+        with self._lock:
+            if version == self._version:
+                return
+
+            with primary_reads():
+                self.build(Ingredient.objects.values(
+                    'id', 'name', 'measurement_unit'
+                ))
+            self._version = version
+
+    def search(self, query):
+        self.refresh()
+        rows, names, trigrams = self._data
+        query = query.strip().lower()
+
+        if not query:
+            return list(rows)
+
+        prefix = []
+        position = bisect_left(names, query)
+        while position < len(names) and names[position].startswith(query):
+            prefix.append(position)
+            position += 1
+
+        if len(query) < 3:
+            candidates = range(len(names))
+        else:
+            candidate_sets = sorted(
+                (
+                    trigrams.get(query[start:start + 3], set())
+                    for start in range(len(query) - 2)
+                ),
+                key=len
+            )
+            candidates = sorted(set.intersection(*candidate_sets))
+
+        prefix_set = set(prefix)
+        substring = [
+            position for position in candidates
+            if position not in prefix_set and query in names[position]
+        ]
+
+        return [rows[position] for position in prefix + substring]
+
+
+ingredient_index = IngredientIndex()
+
+
+class RecipeIngredientIndex:
+    """
+    Инвертированный индекс: ингредиент -> отсортированный список id
+    рецептов. Обновляется по журналу измененных рецептов.
+    """
+    full_rebuild_threshold = 500
+    change_gap_timeout = 10
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seq = None
+        self._refreshed = None
+        self.postings = {}
+        self.recipe_ingredients = {}
+
+    def rebuild(self):
+        postings = {}
+        recipe_ingredients = {}
+        relations = IngredientRecipeRelation.objects.order_by(
+            'recipe_id'
+        ).values_list('recipe_id', 'ingredient_id')
+
+        for recipe_id, ingredient_id in relations.iterator():
+            postings.setdefault(ingredient_id, []).append(recipe_id)
+            recipe_ingredients.setdefault(recipe_id, set()).add(
+                ingredient_id
+            )
+
+        self.postings = postings
+        self.recipe_ingredients = recipe_ingredients
+
+    def apply_changes(self, recipe_ids):
+        new_ingredients = {recipe_id: set() for recipe_id in recipe_ids}
+        relations = IngredientRecipeRelation.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('recipe_id', 'ingredient_id')
+
+        for recipe_id, ingredient_id in relations:
+            new_ingredients[recipe_id].add(ingredient_id)
+
+        for recipe_id, ingredients in new_ingredients.items():
+            for ingredient_id in self.recipe_ingredients.pop(recipe_id, ()):
+                postings = self.postings[ingredient_id]
+                position = bisect_left(postings, recipe_id)
+                if (
+                    position < len(postings)
+                    and postings[position] == recipe_id
+                ):
+                    del postings[position]
+
+            if ingredients:
+                self.recipe_ingredients[recipe_id] = ingredients
+                for ingredient_id in ingredients:
+                    insort(
+                        self.postings.setdefault(ingredient_id, []),
+                        recipe_id
+                    )
+
+    def next_seq(self, changes):
+        """
+        Номер, до которого журнал прочитан без пропусков. Пропуск может
+        быть еще не закоммиченной записью, поэтому записи за ним читаются
+        повторно, пока пропуск не станет старше change_gap_timeout.
+        """
+        seq = self._seq
+        cutoff = timezone.now() - timedelta(seconds=self.change_gap_timeout)
+
+        for change_id, _, created in changes:
+            if change_id != seq + 1 and created > cutoff:
+                break
+            seq = change_id
+
+        return seq
+
+    def refresh(self):
+        with self._lock, primary_reads():
+            # Давно не обновлявшийся индекс мог пропустить уже удаленные
+            # записи журнала
+            if (
+                self._seq is None
+                or time.monotonic() - self._refreshed
+                > RECIPE_CHANGES_TIMEOUT / 2
+            ):
+                self._seq = RecipeChange.objects.aggregate(
+                    last=Max('id')
+                )['last'] or 0
+                self.rebuild()
+                self._refreshed = time.monotonic()
+                return
+
+            changes = list(RecipeChange.objects.filter(
+                id__gt=self._seq
+            ).order_by('id').values_list(
+                'id', 'recipe_id', 'created'
+            )[:self.full_rebuild_threshold + 1])
+
+            if not changes:
+                return
+
+            if len(changes) > self.full_rebuild_threshold:
+                self._seq = changes[-1][0]
+                self.rebuild()
+            else:
+                self.apply_changes({recipe_id for _, recipe_id, _ in changes})
+                self._seq = self.next_seq(changes)
+
+            self._refreshed = time.monotonic()
+
+    def rank(self, ingredient_ids):
+        """
+        Рецепты, в которых есть хотя бы один из ингредиентов, по убыванию
+        доли имеющихся ингредиентов: список пар (id рецепта, доля).
+        """
+        self.refresh()
+        hits = Counter()
+
+        for ingredient_id in set(ingredient_ids):
+            hits.update(self.postings.get(ingredient_id, ()))
+
+        ranked = sorted(
+            (
+                (count / len(self.recipe_ingredients[recipe_id]), count,
+                 recipe_id)
+                for recipe_id, count in hits.items()
+            ),
+            reverse=True
+        )
+
+        return [(recipe_id, coverage) for coverage, _, recipe_id in ranked]
+
+
+recipe_ingredient_index = RecipeIngredientIndex()
+
+
+class Headline(Func):
+    function = 'ts_headline'
+    output_field = TextField()
+
+
+class PostgresRecipeSearch:
+    """
+    Полнотекстовый поиск по индексу search_vector (GIN) с ранжированием.
+    """
+
+    def search(self, queryset, query):
+        search_query = SearchQuery(query, config=SEARCH_CONFIG)
+
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query),
+        ).order_by('-search_rank', '-id')
+
+    def snippets(self, recipes, query):
+        """
+        Фрагменты с подсветкой {id: html} для уже выбранной страницы:
+        ts_headline дорогой, поэтому не входит в запрос поиска, где его
+        посчитал бы и COUNT пагинации для всех найденных рецептов.
+        """
+        headlines = Recipe.objects.filter(
+            id__in=[recipe.id for recipe in recipes]
+        ).annotate(
+            search_snippet=Headline(
+                Value(SEARCH_CONFIG), F('text'),
+                SearchQuery(query, config=SEARCH_CONFIG),
+                Value(SNIPPET_OPTIONS)
+            )
+        ).values_list('id', 'search_snippet')
+
+        return {
+            recipe_id: html.escape(snippet).replace(
+                SNIPPET_START, '<b>'
+            ).replace(SNIPPET_STOP, '</b>')
+            for recipe_id, snippet in headlines
+        }
+
+
+class SimpleRecipeSearch:
+    """
+    Запасной поиск по подстроке для баз без полнотекстового поиска
+    (SQLite в тестах). Совпадения в названии выше, чем в тексте.
+    """
+
+    def search(self, queryset, query):
+        return queryset.filter(
+            Q(name__icontains=query) | Q(text__icontains=query)
+        ).annotate(
+            search_rank=Case(
+                When(name__icontains=query, then=Value(2)),
+                default=Value(1),
+                output_field=IntegerField(),
+            )
+        ).order_by('-search_rank', '-id')
+
+    def snippets(self, recipes, query):
+        return {
+            recipe.id: self.highlight(recipe, query) for recipe in recipes
+        }
+
+    def highlight(self, recipe, query):
+        match = re.search(re.escape(query), recipe.text, re.IGNORECASE)
+        if match is None:
+            return html.escape(recipe.text[:SNIPPET_RADIUS * 2])
+
+        start = max(match.start() - SNIPPET_RADIUS, 0)
+        end = match.end() + SNIPPET_RADIUS
+
+        return (
+            html.escape(recipe.text[start:match.start()])
+            + '<b>' + html.escape(match.group()) + '</b>'
+            + html.escape(recipe.text[match.end():end])
+        )
+
+
+def get_recipe_search():
+    if connection.vendor == 'postgresql':
+        return PostgresRecipeSearch()
+
+    return SimpleRecipeSearch()
@@ -0,0 +1,198 @@
+import heapq
+import math
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+from foodgram.db_routing import primary_reads
+
+from .models import (
+    SIMILAR_RECIPES_CACHE_KEY,
+    IngredientRecipeRelation,
+    Recipe,
+    SimilarRecipe,
+)
+
+NEIGHBORS_COUNT = 10
+INGREDIENTS_WEIGHT = 0.8
+TAGS_WEIGHT = 0.2
+NEIGHBORS_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+class RecipeMatrix:
+    """
+    Разреженная матрица рецепт x ингредиент и множества тегов рецептов.
+    Похожесть: косинус по ингредиентам и коэффициент Жаккара по тегам.
+    Кандидаты для рецепта берутся только из списков его ингредиентов.
+    """
+
+    def __init__(self):
+        self.ingredients = {}
+        self.tags = {}
+        self.postings = {}
+
+    def load(self):
+        relations = IngredientRecipeRelation.objects.values_list(
+            'recipe_id', 'ingredient_id'
+        )
+        for recipe_id, ingredient_id in relations.iterator():
+            self.ingredients.setdefault(recipe_id, set()).add(ingredient_id)
+            self.postings.setdefault(ingredient_id, []).append(recipe_id)
+
+        recipe_tags = Recipe.tags.through.objects.values_list(
+            'recipe_id', 'tag_id'
+        )
+        for recipe_id, tag_id in recipe_tags.iterator():
+            self.tags.setdefault(recipe_id, set()).add(tag_id)
+
+        return self
+
+    def scores(self, recipe_id):
+        """
+        Пары (похожесть, id) для всех рецептов с общими ингредиентами.
+        Похожесть симметрична.
+        """
+        ingredients = self.ingredients.get(recipe_id)
+        if not ingredients:
+            return []
+
+        overlaps = Counter()
+        for ingredient_id in ingredients:
+            overlaps.update(self.postings[ingredient_id])
+        del overlaps[recipe_id]
+
+        tags = self.tags.get(recipe_id, set())
+        scores = []
+
+        for other_id, overlap in overlaps.items():
+            score = INGREDIENTS_WEIGHT * overlap / math.sqrt(
+                len(ingredients) * len(self.ingredients[other_id])
+            )
+            other_tags = self.tags.get(other_id, set())
+            if tags or other_tags:
+                score += TAGS_WEIGHT * (
+                    len(tags & other_tags) / len(tags | other_tags)
+                )
+
+            scores.append((score, other_id))
+
+        return scores
+
+    def neighbors(self, recipe_id, count=NEIGHBORS_COUNT):
+        return heapq.nlargest(count, self.scores(recipe_id))
+
+
+def stale_recipe_ids():
+    return set(Recipe.objects.filter(
+        Q(neighbors_updated__isnull=True)
+        | Q(updated__gt=F('neighbors_updated'))
+    ).values_list('id', flat=True))
+
+
+def entering_recipe_ids(matrix, stale):
+    """
+    Рецепты, в чей список похожих может войти один из измененных:
+    его похожесть больше худшей в текущем списке или список неполон.
+    """
+    best_scores = {}
+    for recipe_id in stale:
+        for score, other_id in matrix.scores(recipe_id):
+            if score > best_scores.get(other_id, 0):
+                best_scores[other_id] = score
+
+    lists = SimilarRecipe.objects.filter(
+        recipe_id__in=best_scores
+    ).values('recipe_id').annotate(
+        worst=Min('score'), size=Count('id')
+    ).values_list('recipe_id', 'worst', 'size')
+    worst_scores = {
+        recipe_id: worst
+        for recipe_id, worst, size in lists
+        if size >= NEIGHBORS_COUNT
+    }
+
+    return {
+        recipe_id for recipe_id, score in best_scores.items()
+        if score > worst_scores.get(recipe_id, 0)
+    }
+
+
+def update_neighbors(full=False, batch=500):
+    """
+    Пересчитывает списки похожих рецептов. Без full пересчитываются только
+    измененные рецепты, списки, в которых они есть, и списки, в которые
+    они могут войти.
+    Возвращает количество пересчитанных рецептов.
+    """
+    started = timezone.now()
+
+    if full:
+        matrix = RecipeMatrix().load()
+        affected = set(Recipe.objects.values_list('id', flat=True))
+    else:
+        stale = stale_recipe_ids()
+        if not stale:
+            return 0
+
+        matrix = RecipeMatrix().load()
+        affected = stale | entering_recipe_ids(matrix, stale) | set(
+            SimilarRecipe.objects.filter(
+                similar__in=stale
+            ).values_list('recipe_id', flat=True)
+        )
+
+    affected = sorted(affected)
+    for start in range(0, len(affected), batch):
+        save_neighbors(matrix, affected[start:start + batch], started)
+
+    return len(affected)
+
+
+@transaction.atomic
+def save_neighbors(matrix, recipe_ids, computed_at):
+    rows = [
+        SimilarRecipe(recipe_id=recipe_id, similar_id=similar_id, score=score)
+        for recipe_id in recipe_ids
+        for score, similar_id in matrix.neighbors(recipe_id)
+    ]
+
+    SimilarRecipe.objects.filter(recipe_id__in=recipe_ids).delete()
+    # Рецепт мог быть удален во время расчета
+    existing = set(Recipe.objects.filter(
+        id__in={row.recipe_id for row in rows}
+        | {row.similar_id for row in rows}
+    ).values_list('id', flat=True))
+    SimilarRecipe.objects.bulk_create([
+        row for row in rows
+        if row.recipe_id in existing and row.similar_id in existing
+    ])
+
+    # Рецепты, измененные после начала расчета, останутся устаревшими
+    Recipe.objects.filter(id__in=recipe_ids).update(
+        neighbors_updated=computed_at
+    )
+    cache.delete_many([
+        SIMILAR_RECIPES_CACHE_KEY.format(recipe_id)
+        for recipe_id in recipe_ids
+    ])
+
+
+def similar_recipe_ids(recipe_id):
+    """
+    id похожих рецептов по убыванию похожести из кеша,
+    при промахе из таблицы SimilarRecipe.
+    """
+    key = SIMILAR_RECIPES_CACHE_KEY.format(recipe_id)
+    similar_ids = cache.get(key)
+
+    if similar_ids is None:
+        with primary_reads():
+            similar_ids = list(SimilarRecipe.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('similar_id', flat=True))
+        cache.set(key, similar_ids, NEIGHBORS_CACHE_TIMEOUT)
+
+    return similar_ids
@@ -17,8 +17,12 @@ class UserAdmin(admin.ModelAdmin):
         'first_name',
         'last_name',
         'role',
+        'recipes_count',
+        'followers_count',
     )
 
+    readonly_fields = ('recipes_count', 'followers_count')
+
     list_editable = (
         'username', 'email', 'first_name', 'last_name', 'role'
     )
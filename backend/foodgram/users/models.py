@@ -1,8 +1,54 @@
+import hashlib
+
 from django.db import models
+from django.db.models.functions import Coalesce, Greatest
 from django.contrib.auth.models import AbstractUser
+from django.core.cache import cache
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+AUTH_TOKEN_CACHE_KEY = 'auth-token:{}'
+
+
+def auth_token_cache_key(key):
+    return AUTH_TOKEN_CACHE_KEY.format(
+        hashlib.sha256(key.encode()).hexdigest()
+    )
+
+
+class CountersMixin:
+    """
+    Счетчики меняются только через F()-выражения, поэтому обычное
+    сохранение объекта не перезаписывает их устаревшими значениями.
+    """
+    counter_fields = ()
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
 
-class User(AbstractUser):
+        super().save(*args, **kwargs)
+
+
+def count_subquery(model, field):
+    """
+    Количество строк model, ссылающихся на объект через field,
+    для пересчета счетчика в одном UPDATE.
+    """
+    return Coalesce(models.Subquery(
+        model.objects.filter(
+            **{field: models.OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            total=models.Count('pk')
+        ).values('total')
+    ), 0)
+
+
+class User(CountersMixin, AbstractUser):
     ADMIN = 'admin'
     MODERATOR = 'moderator'
     USER = 'user'
@@ -26,6 +72,10 @@ class User(AbstractUser):
     first_name = models.CharField(max_length=150,)
     last_name = models.CharField(max_length=150,)
     email = models.EmailField(max_length=150, unique=True)
+    recipes_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+
+    counter_fields = ('recipes_count', 'followers_count')
 
     @property
     def is_admin(self):
@@ -38,6 +88,9 @@ class User(AbstractUser):
     def is_subscribed(self, author):
         return Follow.objects.filter(user=self, author=author).exists()
 
+    def followed_authors_ids(self):
+        return set(self.followings.values_list('author_id', flat=True))
+
 
 class Follow(models.Model):
     user = models.ForeignKey(
@@ -60,3 +113,39 @@ class Follow(models.Model):
                 name='following'
             ),
         )
+
+
+def change_followers_count(author_id, delta):
+    User.objects.filter(pk=author_id).update(
+        followers_count=Greatest(models.F('followers_count') + delta, 0)
+    )
+
+
+@receiver(models.signals.post_save, sender=Follow)
+def increase_followers_count(sender, instance, created, **kwargs):
+    if created:
+        change_followers_count(instance.author_id, 1)
+
+
+@receiver(models.signals.post_delete, sender=Follow)
+def decrease_followers_count(sender, instance, **kwargs):
+    change_followers_count(instance.author_id, -1)
+
+
+@receiver(models.signals.post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    # Выход, смена пароля и удаление пользователя удаляют токены
+    cache.delete(auth_token_cache_key(instance.key))
+
+
+@receiver(models.signals.post_save, sender=User)
+def forget_user_tokens(sender, instance, created, **kwargs):
+    '''
+    Закешированный пользователь устаревает при любом сохранении,
+    в том числе при смене роли или is_active.
+    '''
+    if created:
+        return
+
+    keys = Token.objects.filter(user=instance).values_list('key', flat=True)
+    cache.delete_many([auth_token_cache_key(key) for key in keys])